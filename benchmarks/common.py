@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+import copy
+import socket
+import itertools
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmark axes, each maps to one or more config keys & the values to measure
+AXES = {
+    'use_exr': (['rendering.use_exr'], [False, True]),
+    'use_mvs': (['rendering.use_mvs'], [False, True]),
+    'resolution': (['rendering.camera.width', 'rendering.camera.height'], [128, 256, 512]),
+    'fog': (['rendering.fog.enable'], [False, True]),
+    'ao': (['rendering.ao.enable'], [False, True]),
+    'ibl': (['lighting.ibl.enable'], [False, True]),
+    'quality': (['rendering.quality'], ['custom', 'preview', 'dataset', 'hero']),
+}
+
+
+def set_key(config, key, value):
+    *parents, leaf = key.split('.')
+    for p in parents:
+        config = config[p]
+    config[leaf] = value
+
+
+def get_key(config, key):
+    for k in key.split('.'):
+        config = config[k]
+    return config
+
+
+def config_variants(base_config, axes, mode='single'):
+    """Yields (settings, config) pairs. In 'single' mode one axis at a time is varied around the base config,
+    'full' measures the cartesian product of all axes."""
+    if mode == 'full':
+        combinations = itertools.product(*[AXES[a][1] for a in axes])
+        settings_list = [dict(zip(axes, values)) for values in combinations]
+    else:
+        base = {a: get_key(base_config, AXES[a][0][0]) for a in axes}
+        settings_list = [base] + [dict(base, **{a: v}) for a in axes for v in AXES[a][1] if v != base[a]]
+
+    for settings in settings_list:
+        config = copy.deepcopy(base_config)
+        for axis, value in settings.items():
+            for key in AXES[axis][0]:
+                set_key(config, key, value)
+        yield settings, config
+
+
+def load_base_config(config_path):
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+    # the HDRI directory is relative to the repository
+    ibl = config['lighting']['ibl']
+    if not os.path.isabs(ibl['directory']):
+        ibl['directory'] = os.path.join(REPO_DIR, ibl['directory'])
+    return config
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, benchmark, results, **meta):
+    """Writes the results together with the information needed to compare them between commits."""
+    data = {
+        'benchmark': benchmark,
+        'commit': git_commit(),
+        'host': socket.gethostname(),
+        'python': sys.version.split()[0],
+        'time': time.time(),
+        **meta,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=4)
+    print(f'Results written to {path}')
@@ -0,0 +1,279 @@
+"""Lightweight stand-in for the bpy and mathutils modules.
+
+It implements just enough of the Blender API used by BlenderInterface to run the whole pipeline in a plain Python
+interpreter. Importers read the vertices & faces of OBJ files, render calls do nothing and saving a render result
+writes a tiny file, so the measured time is the Python overhead of the pipeline itself.
+"""
+import os
+import sys
+import zlib
+import types
+import struct
+
+import numpy as np
+
+
+class Stub():
+    """Accepts any attribute, unknown attributes are created as nested stubs and calls do nothing."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = Stub()
+        setattr(self, name, value)
+        return value
+
+    def __call__(self, *args, **kwargs):
+        return None
+
+
+class Matrix(list):
+    def __init__(self, rows=()):
+        super().__init__([list(r) for r in rows])
+
+    @classmethod
+    def Identity(cls, n):
+        return cls(np.eye(n).tolist())
+
+
+class Vector(list):
+    pass
+
+
+class Socket(Stub):
+    def __init__(self):
+        super().__init__(default_value=[0.0, 0.0, 0.0, 1.0], is_linked=False, links=[])
+
+
+class Sockets(dict):
+    def __missing__(self, key):
+        self[key] = Socket()
+        return self[key]
+
+
+class Node(Stub):
+    def __init__(self, name):
+        super().__init__(name=name, inputs=Sockets(), outputs=Sockets(), mute=False)
+
+
+class Nodes(dict):
+    def __missing__(self, key):
+        self[key] = Node(key)
+        return self[key]
+
+    def new(self, type):
+        name = type
+        while name in self:
+            name += '.001'
+        self[name] = Node(name)
+        return self[name]
+
+    # bpy collections iterate over their items, not their names
+    def __iter__(self):
+        return iter(list(self.values()))
+
+    def remove(self, node):
+        del self[node.name]
+
+
+def node_tree():
+    return Stub(nodes=Nodes(), links=Stub(new=lambda *args: None))
+
+
+class Views(dict):
+    def __init__(self):
+        super().__init__()
+        for name, suffix in [('left', '_L'), ('right', '_R')]:
+            self.new(name).camera_suffix = suffix
+
+    def new(self, name):
+        self[name] = Stub(name=name, use=True, camera_suffix='')
+        return self[name]
+
+    def __iter__(self):
+        return iter(list(self.values()))
+
+
+class Vertices():
+    def __init__(self, co):
+        self.co = co
+
+    def __len__(self):
+        return len(self.co)
+
+    def foreach_get(self, attr, buffer):
+        buffer[:] = self.co.reshape(-1)
+
+    def foreach_set(self, attr, buffer):
+        self.co = np.asarray(buffer, dtype=np.float64).reshape(-1, 3)
+
+
+class LoopTriangles():
+    def __init__(self, triangles):
+        self.triangles = triangles
+
+    def __len__(self):
+        return len(self.triangles)
+
+    def foreach_get(self, attr, buffer):
+        buffer[:] = self.triangles.reshape(-1)
+
+
+class Mesh(Stub):
+    def __init__(self, co, faces, triangles):
+        super().__init__(vertices=Vertices(co), polygons=faces, materials=[], loop_triangles=LoopTriangles(triangles))
+
+    def calc_loop_triangles(self):
+        pass
+
+    def transform(self, matrix):
+        m = np.asarray(matrix)
+        self.vertices.co = self.vertices.co @ m[:3, :3].T + m[:3, 3]
+
+    def update(self):
+        pass
+
+
+class Object(Stub):
+    def __init__(self, name, data=None):
+        super().__init__(name=name, data=data if data is not None else Stub(), location=[0.0, 0.0, 0.0],
+                         rotation_euler=[0.0, 0.0, 0.0], matrix_world=Matrix.Identity(4), parent=None,
+                         constraints=Stub(new=lambda type: Stub()), modifiers=Stub(new=lambda name, type: Stub()))
+
+    @property
+    def dimensions(self):
+        if not isinstance(self.data, Mesh) or len(self.data.vertices) == 0:
+            return [0.0, 0.0, 0.0]
+        co = self.data.vertices.co
+        return (co.max(axis=0) - co.min(axis=0)).tolist()
+
+
+class Collection(list):
+    def remove(self, item):
+        if item in self:
+            super().remove(item)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            for item in self:
+                if item.name == key:
+                    return item
+            raise KeyError(key)
+        return super().__getitem__(key)
+
+
+def png_chunk(kind, payload):
+    return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+
+
+# 1x1 RGBA image stored without compression, like a PNG saved with compression 0
+TINY_PNG = b''.join([b'\x89PNG\r\n\x1a\n', png_chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 6, 0, 0, 0)),
+                     png_chunk(b'IDAT', zlib.compress(b'\0\x80\x80\x80\xff', 0)), png_chunk(b'IEND', b'')])
+
+
+class Image(Stub):
+    def __init__(self, name):
+        super().__init__(name=name, colorspace_settings=Stub(), users=1, size=[2048, 1024])
+
+    def copy(self):
+        return Image(self.name + '.001')
+
+    def scale(self, width, height):
+        self.size = [width, height]
+
+    def save_render(self, filepath, scene=None):
+        paths = [filepath]
+        if scene is not None and scene.render.use_multiview:
+            # individual views get their suffix inserted before the extension
+            root, ext = os.path.splitext(filepath)
+            paths = [root + v.camera_suffix + ext for v in scene.render.views if v.use]
+        for path in paths:
+            with open(path, 'wb') as f:
+                f.write(TINY_PNG if path.endswith('.png') else b'\0' * 64)
+
+
+def read_obj(filepath):
+    vertices, num_faces, triangles = [], 0, []
+    with open(filepath, 'r') as f:
+        for line in f:
+            if line.startswith('v '):
+                vertices.append(line.split()[1:4])
+            elif line.startswith('f '):
+                num_faces += 1
+                face = [int(v.split('/')[0]) - 1 for v in line.split()[1:]]
+                triangles += [[face[0], face[i], face[i + 1]] for i in range(1, len(face) - 1)]
+    return (np.asarray(vertices, dtype=np.float64), [None] * num_faces,
+            np.asarray(triangles, dtype=np.int32).reshape(-1, 3))
+
+
+def install(version=(4, 2, 0)):
+    """Creates the stand-in modules and registers them as bpy & mathutils."""
+    bpy = types.ModuleType('bpy')
+    mathutils = types.ModuleType('mathutils')
+    mathutils.Matrix = Matrix
+    mathutils.Vector = Vector
+    mathutils.bvhtree = types.ModuleType('mathutils.bvhtree')
+    mathutils.bvhtree.BVHTree = Stub()
+
+    objects = Collection()
+    images = Collection([Image('Render Result')])
+    view_layer = Stub(objects=Stub(active=None), update=lambda: None)
+    scene = Stub(render=Stub(resolution_x=256, resolution_y=256, resolution_percentage=100,
+                             pixel_aspect_x=1.0, pixel_aspect_y=1.0, image_settings=Stub(),
+                             use_multiview=False, views=Views()),
+                 world=Stub(node_tree=node_tree(), mist_settings=Stub()),
+                 node_tree=node_tree(),
+                 view_layers={'ViewLayer': Stub()},
+                 cursor=Stub(), camera=None, frame_current=1)
+    context = Stub(scene=scene, view_layer=view_layer, selected_objects=[])
+
+    def add_object(name, data=None, **kwargs):
+        obj = Object(name, data)
+        if 'location' in kwargs:
+            obj.location = list(kwargs['location'])
+        objects.append(obj)
+        context.selected_objects = [obj]
+        view_layer.objects.active = obj
+        return obj
+
+    def import_obj(filepath, **kwargs):
+        co, faces, triangles = read_obj(filepath)
+        add_object(os.path.basename(filepath), Mesh(co, faces, triangles))
+
+    def load_image(filepath, **kwargs):
+        images.append(Image(os.path.basename(filepath)))
+        return images[-1]
+
+    def render(**kwargs):
+        # the file output nodes write their multilayer EXRs during the render
+        for node in scene.node_tree.nodes:
+            if node.name.startswith('CompositorNodeOutputFile'):
+                suffixes = ['']
+                if scene.render.use_multiview and node.format.views_format != 'MULTIVIEW':
+                    # individual views are written to one file per view, named with the view's suffix
+                    suffixes = [v.camera_suffix for v in scene.render.views if v.use]
+                for suffix in suffixes:
+                    with open(f'{node.base_path}{scene.frame_current:04d}{suffix}.exr', 'wb') as f:
+                        f.write(b'\0' * 64)
+
+    camera_data = lambda: Stub(lens=50.0, sensor_width=36.0, sensor_height=36.0, sensor_fit='AUTO', angle=0.785)
+    bpy.ops = Stub(
+        object=Stub(empty_add=lambda **kwargs: add_object('Empty', **kwargs),
+                    camera_add=lambda **kwargs: add_object('Camera', camera_data(), **kwargs),
+                    light_add=lambda **kwargs: add_object('Light', Stub(), **kwargs)),
+        wm=Stub(obj_import=import_obj, ply_import=import_obj),
+        import_scene=Stub(gltf=import_obj),
+        render=Stub(render=render),
+    )
+    images.load = load_image
+    bpy.data = Stub(objects=objects, images=images, orphans_purge=lambda **kwargs: None)
+    bpy.context = context
+    bpy.app = Stub(version=version)
+
+    sys.modules['bpy'] = bpy
+    sys.modules['mathutils'] = mathutils
+    sys.modules['mathutils.bvhtree'] = mathutils.bvhtree
+    return bpy
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import common
+import fake_bpy
+import synthetic
+
+# the stand-in has to be registered before the renderer imports bpy
+fake_bpy.install()
+sys.path.append(common.REPO_DIR)
+import util
+import profiling
+import blender_interface
+
+
+def run(config, meshes, repeats):
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        config['out_dir'] = out_dir
+        start = time.perf_counter()
+        renderer = blender_interface.BlenderInterface(config)
+        setup_seconds = time.perf_counter() - start
+        for mesh in meshes:
+            for r in range(repeats):
+                start = time.perf_counter()
+                renderer.import_mesh(mesh)
+                positions = util.sample_camera_positions(config, renderer.fit_to_view())
+                renderer.render(os.path.splitext(os.path.basename(mesh))[0] + f'_{r}', positions, write_cam_params=True)
+                renderer.clear_object()
+                seconds = time.perf_counter() - start
+                results.append({'mesh': os.path.basename(mesh), 'seconds_per_instance': seconds,
+                                'views_per_second': len(positions) * len(renderer.camera['cams']) / seconds})
+        renderer.close()
+        # attach the per-stage timings of every instance
+        for result, record in zip(results, sorted(profiling.load_records(out_dir), key=lambda r: r['time'])):
+            result.update({'vertices': record['vertices'], 'faces': record['faces'], 'stages': record['stages']})
+    return setup_seconds, results
+
+
+def main():
+    p = argparse.ArgumentParser(description='Measures the Python overhead of the render pipeline with a stand-in for bpy.')
+    p.add_argument('--config', type=str, default=os.path.join(common.REPO_DIR, 'render_config.json'), help='Base config.')
+    p.add_argument('--vertices', type=int, nargs='+', default=[10000, 100000, 1000000], help='Synthetic mesh sizes.')
+    p.add_argument('--num_observations', type=int, default=50, help='Views per instance.')
+    p.add_argument('--repeats', type=int, default=3, help='Instances rendered per mesh.')
+    p.add_argument('--mesh_dir', type=str, default=os.path.join(tempfile.gettempdir(), 'shapenet_renderer_bench'),
+                   help='Directory for the synthetic meshes.')
+    p.add_argument('--out', type=str, default='overhead_benchmark.json', help='Machine-readable result file.')
+    opt = p.parse_args()
+
+    config = common.load_base_config(opt.config)
+    config['num_observations'] = opt.num_observations
+    meshes = [os.path.join(common.REPO_DIR, 'teapot.obj')] + synthetic.generate_meshes(opt.mesh_dir, opt.vertices)
+
+    setup_seconds, results = run(config, meshes, opt.repeats)
+    for r in results:
+        print(f'{r["mesh"]:<24} {r["seconds_per_instance"]:8.3f} s/instance {r["views_per_second"]:10.1f} views/s')
+    common.write_results(opt.out, 'overhead', results, setup_seconds=setup_seconds,
+                         num_observations=opt.num_observations)
+
+
+if __name__ == '__main__':
+    main()
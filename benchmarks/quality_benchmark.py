@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import copy
+import json
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import common
+import synthetic
+
+sys.path.append(common.REPO_DIR)
+import bpy
+import util
+import quality
+import variants
+import blender_interface
+
+
+def read_image(path):
+    image = bpy.data.images.load(path)
+    pixels = np.empty(image.size[0] * image.size[1] * image.channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    pixels = pixels.reshape(image.size[1], image.size[0], image.channels)[..., :3]
+    bpy.data.images.remove(image)
+    return pixels
+
+
+def image_difference(path, reference_path):
+    diff = read_image(path) - read_image(reference_path)
+    mse = float(np.mean(diff ** 2))
+    return {'mae': float(np.mean(np.abs(diff))), 'psnr': 10 * np.log10(1.0 / mse) if mse > 0 else float('inf')}
+
+
+def deterministic_config(base_config):
+    """Same views, sun & environment for every profile, PNG output only."""
+    config = copy.deepcopy(base_config)
+    config['mode'] = 'test'
+    config['lighting']['is_random'] = False
+    ibl = config['lighting']['ibl']
+    ibl['random_rotation'] = False
+    ibl['per_instance'] = False
+    if ibl['file_path'] == '':
+        with open(os.path.join(ibl['directory'], 'config.json'), 'r') as f:
+            ibl['file_path'] = json.load(f)[0]['name']
+    config['rendering']['use_exr'] = False
+    config['rendering']['output_formats'] = ['PNG']
+    config['output'] = {'backend': 'files'}
+    return config
+
+
+def run(config, profiles, meshes, out_dir):
+    config['out_dir'] = out_dir
+    config['variants'] = [{'name': p, 'config': {'rendering': {'quality': p}}} for p in profiles]
+    configs = dict(variants.expand_variants(config))
+    renderer = blender_interface.BlenderInterface(configs[profiles[0]])
+    seconds = {p: 0.0 for p in profiles}
+    num_views = 0
+    for mesh in meshes:
+        instance_name = os.path.splitext(os.path.basename(mesh))[0]
+        renderer.import_mesh(mesh)
+        for profile in profiles:
+            renderer.apply_variant(configs[profile])
+            positions = util.sample_camera_positions(configs[profile], renderer.fit_to_view())
+            # the first render after switching the settings compiles the shaders, it is not timed
+            renderer.render('warmup', positions[:1])
+            start = time.perf_counter()
+            renderer.render(instance_name, positions, write_cam_params=True)
+            seconds[profile] += time.perf_counter() - start
+        num_views += len(positions) * len(renderer.camera['cams'])
+        renderer.clear_object()
+    renderer.close()
+    return configs, seconds, num_views
+
+
+def main():
+    p = argparse.ArgumentParser(description='Compares render time and image difference of the quality profiles.')
+    p.add_argument('--config', type=str, default=os.path.join(common.REPO_DIR, 'render_config.json'), help='Base config.')
+    p.add_argument('--profiles', type=str, nargs='+', default=['custom'] + list(quality.PROFILES.keys()),
+                   help='Quality profiles to compare.')
+    p.add_argument('--reference', type=str, default='hero', help='Profile the images are compared to.')
+    p.add_argument('--psnr_threshold', type=float, default=35.0,
+                   help='Minimum PSNR [dB] to the reference for a profile to count as visually equivalent.')
+    p.add_argument('--vertices', type=int, nargs='+', default=[100000], help='Synthetic mesh sizes.')
+    p.add_argument('--num_observations', type=int, default=10, help='Views per instance.')
+    p.add_argument('--mesh_dir', type=str, default=os.path.join(tempfile.gettempdir(), 'shapenet_renderer_bench'),
+                   help='Directory for the synthetic meshes.')
+    p.add_argument('--out', type=str, default='quality_benchmark.json', help='Machine-readable result file.')
+
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    opt = p.parse_args(argv)
+    profiles = [opt.reference] + [p for p in opt.profiles if p != opt.reference]
+
+    base_config = deterministic_config(common.load_base_config(opt.config))
+    base_config['num_observations'] = opt.num_observations
+    meshes = [os.path.join(common.REPO_DIR, 'teapot.obj')] + synthetic.generate_meshes(opt.mesh_dir, opt.vertices)
+
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        configs, seconds, num_views = run(base_config, profiles, meshes, out_dir)
+        for profile in profiles:
+            differences = []
+            for mesh in meshes:
+                instance_name = os.path.splitext(os.path.basename(mesh))[0]
+                img_dir = os.path.join(configs[profile]['out_dir'], instance_name, 'rgb')
+                reference_dir = os.path.join(configs[opt.reference]['out_dir'], instance_name, 'rgb')
+                differences += [image_difference(os.path.join(img_dir, f), os.path.join(reference_dir, f))
+                                for f in sorted(os.listdir(img_dir))]
+            results.append({'profile': profile, 'seconds_per_view': seconds[profile] / num_views,
+                            'mae': float(np.mean([d['mae'] for d in differences])),
+                            'psnr_mean': float(np.mean([d['psnr'] for d in differences])),
+                            'psnr_min': float(np.min([d['psnr'] for d in differences])),
+                            'settings': quality.resolve(configs[profile])})
+
+    print(f'{"profile":<10} {"s/view":>10} {"MAE":>10} {"PSNR [dB]":>10} {"min PSNR":>10}')
+    for r in results:
+        print(f'{r["profile"]:<10} {r["seconds_per_view"]:>10.4f} {r["mae"]:>10.5f} {r["psnr_mean"]:>10.2f} '
+              f'{r["psnr_min"]:>10.2f}')
+    equivalent = [r for r in results if r['psnr_min'] >= opt.psnr_threshold]
+    cheapest = min(equivalent, key=lambda r: r['seconds_per_view'])
+    print(f'Cheapest profile within {opt.psnr_threshold} dB of {opt.reference}: {cheapest["profile"]}')
+    common.write_results(opt.out, 'quality', results, blender=bpy.app.version_string, reference=opt.reference,
+                         psnr_threshold=opt.psnr_threshold, num_observations=opt.num_observations,
+                         resolution=[base_config['rendering']['camera']['width'],
+                                     base_config['rendering']['camera']['height']])
+
+
+if __name__ == '__main__':
+    main()
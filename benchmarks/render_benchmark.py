@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import common
+import synthetic
+
+sys.path.append(common.REPO_DIR)
+import bpy
+import util
+import profiling
+import blender_interface
+
+
+def run_variant(config, meshes, repeats):
+    # start every variant from a clean scene
+    bpy.ops.wm.read_factory_settings(use_empty=False)
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        config['out_dir'] = out_dir
+        start = time.perf_counter()
+        renderer = blender_interface.BlenderInterface(config)
+        setup_seconds = time.perf_counter() - start
+        for mesh in meshes:
+            for r in range(repeats):
+                start = time.perf_counter()
+                renderer.import_mesh(mesh)
+                positions = util.sample_camera_positions(config, renderer.fit_to_view())
+                renderer.render(os.path.splitext(os.path.basename(mesh))[0] + f'_{r}', positions, write_cam_params=True)
+                renderer.clear_object()
+                seconds = time.perf_counter() - start
+                results.append({'mesh': os.path.basename(mesh), 'seconds_per_instance': seconds,
+                                'views_per_second': len(positions) * len(renderer.camera['cams']) / seconds,
+                                'setup_seconds': setup_seconds})
+        renderer.close()
+        for result, record in zip(results, sorted(profiling.load_records(out_dir), key=lambda r: r['time'])):
+            result.update({'vertices': record['vertices'], 'faces': record['faces'], 'stages': record['stages'],
+                           'output_bytes': record['output_bytes']})
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description='Measures views per second and seconds per instance across config axes.')
+    p.add_argument('--config', type=str, default=os.path.join(common.REPO_DIR, 'render_config.json'), help='Base config.')
+    p.add_argument('--axes', type=str, nargs='+', default=list(common.AXES), choices=list(common.AXES),
+                   help='Config axes to vary.')
+    p.add_argument('--mode', type=str, default='single', choices=['single', 'full'],
+                   help='Vary one axis at a time or measure all combinations.')
+    p.add_argument('--vertices', type=int, nargs='+', default=[10000, 100000, 1000000], help='Synthetic mesh sizes.')
+    p.add_argument('--num_observations', type=int, default=10, help='Views per instance.')
+    p.add_argument('--repeats', type=int, default=1, help='Instances rendered per mesh.')
+    p.add_argument('--mesh_dir', type=str, default=os.path.join(tempfile.gettempdir(), 'shapenet_renderer_bench'),
+                   help='Directory for the synthetic meshes.')
+    p.add_argument('--out', type=str, default='render_benchmark.json', help='Machine-readable result file.')
+
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    opt = p.parse_args(argv)
+
+    base_config = common.load_base_config(opt.config)
+    base_config['num_observations'] = opt.num_observations
+    meshes = [os.path.join(common.REPO_DIR, 'teapot.obj')] + synthetic.generate_meshes(opt.mesh_dir, opt.vertices)
+
+    results = []
+    for settings, config in common.config_variants(base_config, opt.axes, opt.mode):
+        print(f'Benchmarking {settings}')
+        for r in run_variant(config, meshes, opt.repeats):
+            results.append({'settings': settings, **r})
+            print(f'  {r["mesh"]:<24} {r["seconds_per_instance"]:8.3f} s/instance {r["views_per_second"]:8.2f} views/s')
+    common.write_results(opt.out, 'render', results, blender=bpy.app.version_string,
+                         num_observations=opt.num_observations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import os
+import argparse
+
+import numpy as np
+
+
+def write_sphere_obj(path, num_vertices):
+    """Writes a UV sphere with roughly the requested number of vertices as OBJ file."""
+    rings = max(3, int(np.sqrt(num_vertices / 2)))
+    segments = max(3, num_vertices // rings)
+    theta = np.linspace(0, np.pi, rings + 2)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    t, p = np.meshgrid(theta, phi, indexing='ij')
+    vertices = np.stack([np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)], axis=-1).reshape(-1, 3)
+    vertices = np.concatenate([vertices, [[0., 0., 1.], [0., 0., -1.]]])
+    top, bottom = len(vertices) - 2, len(vertices) - 1
+
+    # quads between neighbouring rings and triangle fans at the poles, 1-based indices
+    idx = np.arange(rings * segments).reshape(rings, segments)
+    nxt = np.roll(idx, -1, axis=1)
+    quads = np.stack([idx[:-1], nxt[:-1], nxt[1:], idx[1:]], axis=-1).reshape(-1, 4) + 1
+    fan_top = np.stack([np.full(segments, top), nxt[0], idx[0]], axis=-1) + 1
+    fan_bottom = np.stack([np.full(segments, bottom), idx[-1], nxt[-1]], axis=-1) + 1
+
+    with open(path, 'w') as f:
+        f.write(f'# synthetic sphere with {len(vertices)} vertices\n')
+        np.savetxt(f, vertices, fmt='v %.6f %.6f %.6f')
+        np.savetxt(f, quads, fmt='f %d %d %d %d')
+        np.savetxt(f, np.concatenate([fan_top, fan_bottom]), fmt='f %d %d %d')
+    return path
+
+
+def generate_meshes(out_dir, vertex_counts):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for n in vertex_counts:
+        path = os.path.join(out_dir, f'sphere_{n}.obj')
+        if not os.path.exists(path):
+            write_sphere_obj(path, n)
+        paths.append(path)
+    return paths
+
+
+def main():
+    p = argparse.ArgumentParser(description='Generates synthetic meshes of growing vertex counts for benchmarking.')
+    p.add_argument('--out_dir', type=str, required=True, help='Directory to write the meshes to.')
+    p.add_argument('--vertices', type=int, nargs='+', default=[10000, 100000, 1000000], help='Vertex counts.')
+    opt = p.parse_args()
+    for path in generate_meshes(opt.out_dir, opt.vertices):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,53 @@
-import json
 import os
 import random
 
 import util
+import manifest
+import shard_writer
+import profiling
+import mesh_cache
+import hdri_pool
+import quality
+import view_planning
+import output_writer
 import bpy
 import numpy as np
+from mathutils import Matrix, Vector
+from mathutils.bvhtree import BVHTree
+
+# File extensions of the supported still image formats, EXRs are written by the file output nodes of rendering.exr
+FILE_EXTENSIONS = {
+    'PNG': 'png',
+    'JPEG': 'jpg',
+    'TIFF': 'tif',
+}
+
+# Passes that can be written to the EXR files: the view layer setting enabling the pass & the outputs of the
+# Render Layers compositor node holding it
+EXR_PASSES = {
+    'combined': (None, ['Image', 'Alpha']),
+    'z': ('use_pass_z', ['Depth']),
+    'normal': ('use_pass_normal', ['Normal']),
+    'mist': ('use_pass_mist', ['Mist']),
+    'position': ('use_pass_position', ['Position']),
+    'diffuse_color': ('use_pass_diffuse_color', ['DiffCol']),
+    'cryptomatte_object': ('use_pass_cryptomatte_object', ['CryptoObject00', 'CryptoObject01', 'CryptoObject02']),
+}
+EXR_PRECISION = {'half': '16', 'full': '32'}
+EXR_CODECS = ['NONE', 'PXR24', 'ZIP', 'PIZ', 'RLE', 'ZIPS', 'B44', 'B44A', 'DWAA', 'DWAB']
+
+
+# Up to n random rows, the same ones on every run
+def sample_rows(points, n):
+    return points[np.random.default_rng(0).choice(len(points), min(len(points), n), replace=False)]
+
+
+# Largest distance of the points to the surface of the BVH, None if a point has no nearest surface point
+def nearest_distance(bvh, points):
+    distances = [bvh.find_nearest(Vector(p))[3] for p in points]
+    if any(d is None for d in distances):
+        return None
+    return max(distances, default=0.0)
 
 
 class BlenderInterface():
@@ -18,11 +61,35 @@ class BlenderInterface():
 
         # Object to render
         self.obj = None
-        self.scale = config['object']['scale']
-        self.center_mode = config['object']['center_mode']
-        self.normalize = config['object']['normalize']
-        # Output directory
-        self.out_dir = config['out_dir']
+        # Compositor nodes, created on first use and shared by all instances
+        self.compositor = None
+        # File output & crop nodes writing the EXR passes, rebuilt when the EXR settings change
+        self.exr = None
+        # World nodes & the environment maps, loaded once for all instances
+        self.world = None
+        self.hdri_pool = None
+        # Memory usage after the last instance was cleared
+        self.memory_usage = None
+        # Timings & statistics of the current instance
+        self.profiler = profiling.Profiler()
+        self.update_config(config)
+
+        # Shard writers per output directory, if the outputs are packed into shards
+        self.shard_writers = {}
+        # Background threads that compress & write the outputs while the next view renders
+        output = config.get('output', {})
+        self.output_writer = None
+        if output.get('writer_threads', 0) > 0:
+            self.output_writer = output_writer.OutputWriter(output['writer_threads'], output.get('max_pending', 64),
+                                                            output.get('staging_dir', ''),
+                                                            output.get('png_compression', 15))
+
+        # Optionally cache the preprocessed meshes across runs
+        cache_config = config.get('mesh_cache', {})
+        self.mesh_cache = None
+        if cache_config.get('enable', False):
+            self.mesh_cache = mesh_cache.MeshCache(cache_config['directory'],
+                                                   int(cache_config['max_size_gb'] * 2 ** 30))
 
         # Set up the camera & lighting
         self.cam_offset = config['rendering']['distance_offset']
@@ -31,16 +98,137 @@ class BlenderInterface():
 
         bpy.ops.object.select_all(action='DESELECT')
 
+    # Update the settings that are read per object, camera & lighting stay untouched
+    def update_config(self, config):
+        self.config = config
+        self.scale = config['object']['scale']
+        self.center_mode = config['object']['center_mode']
+        self.normalize = config['object']['normalize']
+        # Output directory
+        self.out_dir = config['out_dir']
+
+    # Switch to another config variant without rebuilding the scene, the current object stays loaded
+    def apply_variant(self, config):
+        previous = self.config
+        if self.obj is not None and config['object'] != previous['object']:
+            raise ValueError('Variants cannot change the object settings, the mesh is only imported once')
+        rig_keys = ['use_mvs', 'mvs', 'mvs_multiview']
+        if [config['rendering'].get(k) for k in rig_keys] != [previous['rendering'].get(k) for k in rig_keys]:
+            raise ValueError('Variants cannot change the camera rig (use_mvs, mvs, mvs_multiview)')
+        self.update_config(config)
+        self.cam_offset = config['rendering']['distance_offset']
+        if config['rendering'] != previous['rendering']:
+            self.apply_camera_settings(self.camera)
+            self.apply_render_settings()
+        lighting, previous_lighting = config['lighting'], previous['lighting']
+        if any(lighting[k] != previous_lighting[k] for k in ['enable', 'is_random', 'ibl', 'sun_light']) or \
+                quality.resolve(config) != quality.resolve(previous):
+            self.apply_sun_settings(self.sun_light)
+        # rebuilding the world picks a new random HDRI, only do it if the world settings changed
+        if any(lighting[k] != previous_lighting[k] for k in lighting if k != 'sun_light'):
+            self.setup_world_props()
+        elif lighting['ibl']['enable'] and config['rendering']['camera'] != previous['rendering']['camera']:
+            self.update_environment_image()
+        if self.obj is not None:
+            self.setup_fog()
+
+    # Import the mesh once and render it under every config variant whose outputs are not complete yet
+    def render_instance(self, fpath, instance_name, variants):
+        pending = [c for c in variants if not manifest.is_complete(manifest.instance_dir(c, instance_name), c)]
+        if not pending:
+            print(f'Skipping {instance_name}, outputs are complete')
+            return False
+        # import with the highest resolution so that the level of detail suits every variant
+        pending.sort(key=lambda c: -c['rendering']['camera']['width'] / np.tan(c['rendering']['camera']['fov'] / 2))
+        self.apply_variant(pending[0])
+        # the environment map is switched per instance by relinking a pooled image
+        ibl_config = self.config['lighting']['ibl']
+        if ibl_config['enable'] and ibl_config.get('per_instance', False):
+            self.select_environment()
+        try:
+            self.import_mesh(fpath)
+            for variant_config in pending:
+                self.apply_variant(variant_config)
+                positions = self.plan_views(instance_name)
+                self.render(instance_name, positions, write_cam_params=True)
+        finally:
+            # remove the object also if rendering failed
+            self.clear_object()
+        return True
+
+    # Camera locations for the current object, the fewest views that cover its surface in coverage mode
+    def plan_views(self, instance_name):
+        radius = self.fit_to_view()
+        planning = self.config.get('view_planning', {})
+        coverage = planning.get('coverage', {})
+        if not coverage.get('enable', False):
+            return util.sample_camera_positions(self.config, radius, instance_name)
+
+        with self.profiler.stage('planning'):
+            seed = view_planning.instance_seed(planning.get('seed'), instance_name)
+            mesh = self.obj.data
+            mesh.calc_loop_triangles()
+            triangles = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+            mesh.loop_triangles.foreach_get('vertices', triangles)
+            vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+            mesh.vertices.foreach_get('co', vertices)
+            # the object is normalized, its vertices are already in world coordinates
+            points, normals = view_planning.surface_samples(vertices.reshape(-1, 3), triangles.reshape(-1, 3),
+                                                            coverage['surface_samples'], seed)
+            candidates = view_planning.fibonacci_sphere(coverage['candidates'], radius, seed)
+            chosen, reached = view_planning.plan_coverage(points, normals, candidates,
+                                                          self.config['rendering']['camera']['fov'],
+                                                          coverage['target'], self.config['num_observations'],
+                                                          coverage['resolution'])
+        self.profiler.set(coverage=float(reached))
+        if not chosen:
+            # no candidate sees any surface sample, e.g. a mesh without faces, an instance without views would be
+            # rendered again on every resume
+            print(f'Coverage planning found no views for {instance_name}, sampling them instead')
+            return util.sample_camera_positions(self.config, radius, instance_name)
+        print(f'{len(chosen)} views cover {reached:.1%} of the visible surface of {instance_name}')
+        return candidates[chosen]
+
+    # Remove the current object from the scene together with its data, so nothing accumulates over a batch
+    def clear_object(self):
+        if self.obj is not None:
+            with self.profiler.stage('cleanup'):
+                bpy.data.objects.remove(self.obj)
+                self.obj = None
+                # mesh, materials, textures & actions of the object are orphans now
+                util.purge_orphan_data()
+            self.memory_usage = util.get_memory_usage()
+            print(f'Memory usage: {self.memory_usage}')
+            self.profiler.write(self.out_dir, self.memory_usage)
+
+    # Shard writer of the current output directory, None if every output is written as a file
+    def get_shard_writer(self):
+        output = self.config.get('output', {})
+        if output.get('backend', 'files') != 'shards':
+            return None
+        if self.out_dir not in self.shard_writers:
+            self.shard_writers[self.out_dir] = shard_writer.ShardWriter(
+                self.out_dir, prefix=output.get('shard_prefix', 'shard'),
+                max_shard_bytes=output.get('shard_size', 1 << 30))
+        return self.shard_writers[self.out_dir]
+
+    # Finish writing outputs that are still open
+    def close(self):
+        # file outputs left in the scene would keep writing for the next interface
+        self.remove_exr_output()
+        if self.output_writer is not None:
+            self.output_writer.close()
+        for writer in self.shard_writers.values():
+            writer.close()
+
     # Setup camera & rendering parameters
     def setup_camera_rendering(self):
-        cam = self.config['rendering']['camera']
-
         bpy.ops.object.empty_add(type='ARROWS',
                                  align='WORLD',
                                  location=(0, 0, 0),
                                  scale=(1, 1, 1))
         root = bpy.context.selected_objects[0]
-        camera = {'root': root, 'cams': []}
+        camera = {'root': root, 'cams': [], 'offsets': [], 'views': None}
 
         bpy.ops.object.empty_add(type='ARROWS', location=(0, 0, 0))
         empty = bpy.context.view_layer.objects.active
@@ -57,7 +245,48 @@ class BlenderInterface():
             c = bpy.context.selected_objects[0]
             c.parent = root
             camera['cams'].append(c)
+            camera['offsets'].append(opt)
+
+        if self.config['rendering']['use_mvs'] and self.config['rendering'].get('mvs_multiview', False):
+            self.setup_multiview(camera)
+        else:
+            bpy.context.scene.render.use_multiview = False
 
+        self.apply_camera_settings(camera)
+        self.apply_render_settings()
+
+        return camera
+
+    # Render all cameras of the rig in one call, Blender's multiview renders one view per camera
+    def setup_multiview(self, camera):
+        render = bpy.context.scene.render
+        render.use_multiview = True
+        render.views_format = 'MULTIVIEW'
+        # the stereo views cannot be removed, only disabled
+        for name in ['left', 'right']:
+            render.views[name].use = False
+        camera['views'] = []
+        for idx, c in enumerate(camera['cams']):
+            # a view renders the camera named like the active camera with the view's suffix, the root's unique name
+            # keeps the cameras of several rigs apart
+            c.name = f'{camera["root"].name}_camera_{idx}'
+            name = f'camera_{idx}'
+            view = render.views[name] if name in render.views else render.views.new(name)
+            view.camera_suffix = f'_{idx}'
+            view.use = True
+            camera['views'].append(view)
+        # views of other rigs with more cameras
+        for view in render.views:
+            if view.name not in ['left', 'right'] and view not in camera['views']:
+                view.use = False
+        # save_render writes every view to its own file, the suffix is inserted before the extension
+        render.image_settings.views_format = 'INDIVIDUAL'
+        bpy.context.scene.camera = camera['cams'][0]
+
+    # Set the intrinsics of all cameras of the rig & the output resolution
+    def apply_camera_settings(self, camera):
+        cam = self.config['rendering']['camera']
+        for c in camera['cams']:
             c.data.lens_unit = 'FOV'
             c.data.angle = cam['fov']
             bpy.context.scene.render.resolution_x = cam['width']
@@ -65,9 +294,14 @@ class BlenderInterface():
             bpy.context.scene.render.resolution_percentage = 100
             c.data.sensor_height = c.data.sensor_width  # Square sensor
 
-        # Rendering
+    # Set the render engine, shadow, AO & color management settings
+    def apply_render_settings(self):
         rendering = self.config['rendering']
         ao = rendering['ao']
+        # samples, shadow & AO quality of the profile, scaled to the output resolution
+        q = quality.resolve(self.config)
+        if q['samples'] is not None:
+            bpy.context.scene.eevee.taa_render_samples = q['samples']
         # Get version of Blender and adjust API
         version = bpy.app.version
         v_id = version[0] * 100 + version[1] * 10 + version[2]
@@ -75,32 +309,35 @@ class BlenderInterface():
             bpy.context.scene.render.engine = 'BLENDER_EEVEE_NEXT'
             # shadows
             bpy.context.scene.eevee.use_shadows = True
+            if q['shadow_rays'] is not None:
+                bpy.context.scene.eevee.shadow_ray_count = q['shadow_rays']
+                bpy.context.scene.eevee.shadow_step_count = q['shadow_steps']
             # if HDRI-based lighting, enable shadows there as well
 
             # ao
-            bpy.context.scene.eevee.use_raytracing = ao['enable']
+            bpy.context.scene.eevee.use_raytracing = q['ao']
             bpy.context.scene.eevee.ray_tracing_method = 'SCREEN'
-            bpy.context.scene.eevee.ray_tracing_options.resolution_scale = '1'
-            bpy.context.scene.eevee.ray_tracing_options.use_denoise = True
-            bpy.context.scene.eevee.use_fast_gi = ao['enable']
+            bpy.context.scene.eevee.ray_tracing_options.resolution_scale = q['raytrace_scale']
+            bpy.context.scene.eevee.ray_tracing_options.use_denoise = q['denoise']
+            bpy.context.scene.eevee.use_fast_gi = q['ao'] and q['fast_gi']
             bpy.context.scene.eevee.fast_gi_method = 'AMBIENT_OCCLUSION_ONLY'
-            bpy.context.scene.eevee.fast_gi_resolution = '1'
+            bpy.context.scene.eevee.fast_gi_resolution = q['raytrace_scale']
         else:
             bpy.context.scene.render.engine = 'BLENDER_EEVEE'
             # shadows
-            bpy.context.scene.eevee.shadow_cascade_size = rendering['shadow']['cascade_size']
-            bpy.context.scene.eevee.use_soft_shadows = rendering['shadow']['use_soft_shadows']
+            bpy.context.scene.eevee.shadow_cascade_size = q['shadow_size']
+            bpy.context.scene.eevee.use_soft_shadows = q['soft_shadows']
             # ao
-            bpy.context.scene.eevee.use_gtao = ao['enable']
+            bpy.context.scene.eevee.use_gtao = q['ao']
             bpy.context.scene.eevee.gtao_distance = ao['distance']
+            if q['gtao_quality'] is not None:
+                bpy.context.scene.eevee.gtao_quality = q['gtao_quality']
             bpy.context.scene.eevee.use_gtao_bent_normals = ao['use_bent_normals']
             bpy.context.scene.eevee.use_gtao_bounce = ao['use_bounce']
         bpy.context.scene.view_settings.view_transform = rendering['color_management']['view_transform']
         bpy.context.scene.view_settings.look = rendering['color_management']['look']
 
-        return camera
-
-    # Setup the world properties
+    # Setup the world properties, the node graph is built once and only updated afterwards
     def setup_world_props(self):
         ibl_config = self.config['lighting']['ibl']
         ambient_color = self.config['lighting']['ambient_light']
@@ -110,71 +347,75 @@ class BlenderInterface():
         world.use_nodes = True
         nodes = world.node_tree.nodes
 
-        # parse the config
-        use_ibl = ibl_config['enable']
-        ibl_directory = ibl_config['directory']
-        ibl_file = ibl_config['file_path']
-        random_rotation = ibl_config['random_rotation']
-        rotation_euler_z = ibl_config['rotation_euler_z']
-
-        # TODO continue here
-        background_shader = nodes.new('ShaderNodeBackground')
-        if use_ibl:
-            with open(os.path.join(ibl_directory, 'config.json'), 'r') as f:
-                hdri_config = json.load(f)
-            # randomly select a sky
-            if ibl_file == "":
-                hdri_bg = random.choice(hdri_config)
-            else:
-                def pick_by_name(k, arr):
-                    for a in arr:
-                        if a['name'] == k:
-                            return a
-                    raise ValueError(f'Could not find {k} in {arr}')
-
-                hdri_bg = pick_by_name(ibl_file, hdri_config)
-
-            print(f'Using IBL with environment {hdri_bg["name"]}')
-            # set up the shader tree
-            background_img = bpy.data.images.load(os.path.join(ibl_directory, hdri_bg['name']))
+        if self.world is None:
+            background_shader = nodes.new('ShaderNodeBackground')
             background_texture = nodes.new('ShaderNodeTexEnvironment')
             background_mapping = nodes.new('ShaderNodeMapping')
             background_coord = nodes.new("ShaderNodeTexCoord")
-
-            background_img.colorspace_settings.name = 'Non-Color'
-            background_texture.image = background_img
-            background_mapping.inputs['Rotation'].default_value[2] = random.uniform(0,
-                                                                                    np.pi * 2) if random_rotation else np.radians(
-                rotation_euler_z)
+            ambient_shader = nodes.new('ShaderNodeBackground')
+            mix_shader = nodes.new('ShaderNodeMixShader')
+            weight = nodes.new('ShaderNodeLightPath')
 
             world.node_tree.links.new(background_coord.outputs['Generated'], background_mapping.inputs['Vector'])
             world.node_tree.links.new(background_mapping.outputs['Vector'], background_texture.inputs['Vector'])
-            world.node_tree.links.new(background_texture.outputs['Color'], background_shader.inputs['Color'])
-            world.node_tree.links.new(background_shader.outputs['Background'], nodes['World Output'].inputs['Surface'])
-
-            # enable shadows
-            world.use_sun_shadow = True
-            world.sun_threshold = hdri_bg['threshold']
-            world.sun_angle = hdri_bg['angle']
+            world.node_tree.links.new(weight.outputs['Is Camera Ray'], mix_shader.inputs[0])
+            world.node_tree.links.new(ambient_shader.outputs[0], mix_shader.inputs[2])
+            world.node_tree.links.new(background_shader.outputs[0], mix_shader.inputs[1])
+            world.node_tree.links.new(nodes['World Output'].inputs[0], mix_shader.outputs[0])
+            self.world = {'background': background_shader, 'texture': background_texture,
+                          'mapping': background_mapping, 'ambient': ambient_shader}
+
+        self.world['ambient'].inputs[0].default_value = bg_color
+        background_color = self.world['background'].inputs['Color']
+        if ibl_config['enable']:
+            if not background_color.is_linked:
+                world.node_tree.links.new(self.world['texture'].outputs['Color'], background_color)
+            self.select_environment()
         else:
-            background_shader.inputs[0].default_value = ambient_color
-
-        ambient_shader = nodes.new('ShaderNodeBackground')
-        ambient_shader.inputs[0].default_value = bg_color
+            for link in list(background_color.links):
+                world.node_tree.links.remove(link)
+            background_color.default_value = ambient_color
 
-        mix_shader = nodes.new('ShaderNodeMixShader')
-        weight = nodes.new('ShaderNodeLightPath')
-
-        world.node_tree.links.new(weight.outputs['Is Camera Ray'], mix_shader.inputs[0])
-        world.node_tree.links.new(ambient_shader.outputs[0], mix_shader.inputs[2])
-        world.node_tree.links.new(background_shader.outputs[0], mix_shader.inputs[1])
-        world.node_tree.links.new(nodes['World Output'].inputs[0], mix_shader.outputs[0])
+    # Switch the environment map of the world, a random one of the pool if no file is configured
+    def select_environment(self):
+        ibl_config = self.config['lighting']['ibl']
+        if self.hdri_pool is None or self.hdri_pool.directory != ibl_config['directory']:
+            self.hdri_pool = hdri_pool.HDRIPool(ibl_config['directory'], ibl_config.get('preload', False))
+        hdri_bg = self.hdri_pool.pick(ibl_config['file_path'])
+        print(f'Using IBL with environment {hdri_bg["name"]}')
+        self.world['hdri'] = hdri_bg['name']
+        self.update_environment_image()
+        self.world['mapping'].inputs['Rotation'].default_value[2] = random.uniform(0, np.pi * 2) \
+            if ibl_config['random_rotation'] else np.radians(ibl_config['rotation_euler_z'])
+
+        # enable shadows
+        world = bpy.context.scene.world
+        world.use_sun_shadow = True
+        world.sun_threshold = hdri_bg['threshold']
+        world.sun_angle = hdri_bg['angle']
+
+    # Link the copy of the current environment map that matches the camera resolution
+    def update_environment_image(self):
+        width = None
+        resolution_scale = self.config['lighting']['ibl'].get('resolution_scale', 1.0)
+        # a resolution scale of 0 keeps the original maps
+        if resolution_scale > 0:
+            width = self.hdri_pool.target_width(self.config['rendering']['camera'], resolution_scale)
+        self.world['texture'].image = self.hdri_pool.get(self.world['hdri'], width)
 
     # Setup lighting
     def setup_lighting(self):
         bpy.ops.object.light_add(type='SUN', location=(0, 0, 0))
         sun_light = bpy.context.view_layer.objects.active
+        self.apply_sun_settings(sun_light)
 
+        # bpy.data.worlds["World"].node_tree.nodes["Background"].inputs[0].default_value = lighting['ambient_light']
+        self.setup_world_props()
+        bpy.ops.object.select_all(action='DESELECT')
+
+        return sun_light
+
+    def apply_sun_settings(self, sun_light):
         lighting = self.config['lighting']
         sun_lighting = lighting['sun_light']
         if lighting['enable']:
@@ -194,19 +435,15 @@ class BlenderInterface():
             sun_light.data.use_contact_shadow = sun_lighting['use_shadow']
             sun_light.data.contact_shadow_distance = sun_lighting['contact_shadow']['distance']
             sun_light.data.contact_shadow_thickness = sun_lighting['contact_shadow']['thickness']
-            sun_light.data.shadow_cascade_count = sun_lighting['cascade_count']
+            sun_light.data.shadow_cascade_count = quality.resolve(self.config)['cascade_count']
             sun_light.data.shadow_cascade_max_distance = sun_lighting['cascade_max_distance']
 
-        # bpy.data.worlds["World"].node_tree.nodes["Background"].inputs[0].default_value = lighting['ambient_light']
-        self.setup_world_props()
-        bpy.ops.object.select_all(action='DESELECT')
-
-        return sun_light
-
     def setup_fog(self):
         fog_config = self.config['rendering']['fog']
-        lighting = self.config['lighting']
         if not fog_config['enable']:
+            # pass the image through if fog was enabled for a previous instance
+            if self.compositor is not None:
+                self.compositor['mix'].mute = True
             return
 
         # fog gamma values
@@ -218,7 +455,17 @@ class BlenderInterface():
         # we assume a sphere that is slightly larger than the camera to avoid fog issues
         bpy.context.scene.world.mist_settings.depth = self.fit_to_view() * fog_gamma[fog_config['preset']]
 
-        # enable compositing
+        # the compositor graph is shared by all instances, only enable it
+        self.setup_compositor()
+        self.compositor['mix'].mute = False
+        self.compositor['mix'].inputs[2].default_value = self.config['lighting']['background_color']
+
+    # Build the compositor graph that blends the mist pass into the image, once per interface
+    def setup_compositor(self):
+        if self.compositor is not None:
+            return
+        lighting = self.config['lighting']
+
         scene = bpy.context.scene
         scene.use_nodes = True
         compositor = scene.node_tree.nodes
@@ -233,18 +480,20 @@ class BlenderInterface():
         scene.node_tree.links.new(compositor['Render Layers'].outputs['Image'], compositor_mix.inputs[1])
         scene.node_tree.links.new(compositor_gamma.outputs[0], compositor_mix.inputs[0])
         scene.node_tree.links.new(compositor_mix.outputs[0], compositor['Composite'].inputs['Image'])
+        self.compositor = {'gamma': compositor_gamma, 'mix': compositor_mix}
 
-    def fit_to_view(self):
+    def fit_to_view(self, obj=None):
         intrin = self.config['rendering']['camera']
         fov = intrin['fov']
         im_w = intrin['width']
         im_h = intrin['height']
-        dims = self.obj.dimensions
+        dims = (obj or self.obj).dimensions
         fov_y = 2.0 * np.arctan(np.tan(fov / 2) / (im_w / im_h))
         r = np.linalg.norm(dims) * 0.5 * 1.1 + self.cam_offset
         return r / min(np.tan(fov / 2), np.tan(fov_y / 2))
 
-    def import_mesh(self, fpath):
+    # Import the mesh file and join all of its parts into a single object
+    def load_mesh_file(self, fpath):
         # deselect everything
         bpy.ops.object.select_all(action='DESELECT')
 
@@ -255,40 +504,119 @@ class BlenderInterface():
             bpy.ops.wm.ply_import(filepath=str(fpath))
         elif ext == '.gltf' or ext == '.glb':
             bpy.ops.import_scene.gltf(filepath=fpath, loglevel=50, import_shading='SMOOTH')
-        # optionally scale the object
-        bpy.ops.transform.resize(value=(self.scale, self.scale, self.scale))
         # join multiple objects together for simplicity
         bpy.ops.object.join()
 
         obj = bpy.context.view_layer.objects.active
         obj.name = os.path.basename(fpath)
-
-        # Apply the world transformation
-        v_mat = np.asarray(obj.matrix_world).T
-        v_coords = (np.hstack((np.asarray([v.co for v in obj.data.vertices]),
-                               np.ones((len(obj.data.vertices), 1)))) @ v_mat)[:, :3]
-
-        # Check whether to normalize the object w.r.t longest axis
+        return obj
+
+    # Scale & center the object, the transformation is baked into the mesh
+    def normalize_object(self, obj):
+        # Read the vertices in bulk and apply the world transformation
+        mesh = obj.data
+        v_local = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', v_local)
+        v_mat = np.asarray(obj.matrix_world, dtype=np.float64)
+        v_coords = v_local.reshape(-1, 3) @ v_mat[:3, :3].T + v_mat[:3, 3]
+
+        # Optionally scale the object, normalized w.r.t longest axis
+        s = self.scale
         if self.normalize:
             s = self.scale / np.abs(v_coords.max(axis=0) - v_coords.min(axis=0)).max()
             print(f'scale: {s}')
-            bpy.ops.transform.resize(value=(s, s, s))
-            bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
+        v_coords *= s
 
         # Center the object at the origin
+        offset = np.zeros(3)
         if self.center_mode != 'none':
-            v_coords = (np.hstack((np.asarray([v.co for v in obj.data.vertices]),
-                                   np.ones((len(obj.data.vertices), 1)))) @ v_mat)[:, :3]
-            # v_centroid = v_coords.mean(axis=0)
-            v_centroid = v_coords.min(axis=0) + 0.5 * (v_coords.max(axis=0) - v_coords.min(axis=0))
             v_min, v_max = v_coords.min(axis=0), v_coords.max(axis=0)
+            offset = v_min + 0.5 * (v_max - v_min)
+            offset[2] = v_min[2] if self.center_mode == 'min' else v_coords[:, 2].mean()
+
+        # Bake world transformation, scale & offset into the vertices with a single matrix
+        transform = np.diag([s, s, s, 1.0])
+        transform[:3, 3] = -offset
+        mesh.transform(Matrix((transform @ v_mat).tolist()))
+        mesh.update()
+        obj.matrix_world = Matrix.Identity(4)
+        # refresh the bounding box used by fit_to_view
+        bpy.context.view_layer.update()
+
+    # Number of triangles the normalized object needs, about triangles_per_pixel per pixel it covers in the image
+    def lod_target(self, obj, triangle_count):
+        lod = self.config['object']['lod']
+        cam = self.config['rendering']['camera']
+        areas = np.empty(len(obj.data.polygons), dtype=np.float64)
+        obj.data.polygons.foreach_get('area', areas)
+        # focal length in pixels & the distance the cameras are placed at
+        focal = cam['width'] / 2 / np.tan(cam['fov'] / 2)
+        distance = self.fit_to_view(obj)
+        # seen from a random direction, a closed surface covers a quarter of its area in the image on average
+        pixels = min(areas.sum() / 4 * (focal / distance) ** 2, cam['width'] * cam['height'])
+        return max(int(pixels * lod['triangles_per_pixel']), lod['min_faces'], int(triangle_count * lod['min_ratio']))
+
+    # Collapse triangles the camera cannot resolve, keeps UVs & materials. The result is rejected if it moves the
+    # surface further than max_error_px pixels away from the original vertices.
+    def decimate_object(self, obj):
+        lod = self.config['object']['lod']
+        mesh = obj.data
+        mesh.calc_loop_triangles()
+        triangle_count = len(mesh.loop_triangles)
+        target = self.lod_target(obj, triangle_count)
+        log = {'faces_before': triangle_count, 'faces_after': triangle_count, 'target': target, 'ratio': 1.0,
+               'error_px': 0.0}
+        if triangle_count <= target:
+            self.profiler.set(lod=log)
+            return
 
-            offset = v_centroid
-            offset[2] = v_min[2] if self.center_mode == 'min' else v_coords.mean(axis=0)[2]
-            bpy.context.scene.cursor.location = offset
-            bpy.ops.object.origin_set(type='ORIGIN_CURSOR', center='MEDIAN')
-            obj.location = (0, 0, 0)
+        cam = self.config['rendering']['camera']
+        pixels_per_unit = cam['width'] / 2 / np.tan(cam['fov'] / 2) / self.fit_to_view(obj)
+        vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get('co', vertices)
+        vertices = sample_rows(vertices.reshape(-1, 3), 2000)
+        # the surface before decimation, to catch parts of the decimated mesh that bulge outwards
+        original = BVHTree.FromObject(obj, bpy.context.evaluated_depsgraph_get())
+
+        modifier = obj.modifiers.new('LOD', 'DECIMATE')
+        modifier.decimate_type = 'COLLAPSE'
+        ratio = target / triangle_count
+        accepted = False
+        # relax the reduction until the error is within the bound
+        while ratio < 1.0:
+            modifier.ratio = ratio
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+            evaluated = obj.evaluated_get(depsgraph).data
+            lod_vertices = np.empty(len(evaluated.vertices) * 3, dtype=np.float64)
+            evaluated.vertices.foreach_get('co', lod_vertices)
+            # symmetric error: dropped parts show in original -> decimated, bulges in decimated -> original
+            distances = [nearest_distance(BVHTree.FromObject(obj, depsgraph), vertices),
+                         nearest_distance(original, sample_rows(lod_vertices.reshape(-1, 3), 2000))]
+            if None in distances:
+                print('LOD: no nearest surface point found, keeping the original mesh')
+                break
+            error = max(distances) * pixels_per_unit
+            print(f'LOD ratio {ratio:.3f}: {error:.2f} px error')
+            if error <= lod['max_error_px']:
+                accepted = True
+                break
+            ratio *= 2
+
+        if accepted:
+            lod_mesh = bpy.data.meshes.new_from_object(obj.evaluated_get(depsgraph), preserve_all_data_layers=True,
+                                                       depsgraph=depsgraph)
+            obj.modifiers.remove(modifier)
+            obj.data = lod_mesh
+            bpy.data.meshes.remove(mesh)
+            lod_mesh.calc_loop_triangles()
+            log.update(faces_after=len(lod_mesh.loop_triangles), ratio=ratio, error_px=error)
+        else:
+            obj.modifiers.remove(modifier)
+        print(f'LOD: {log["faces_before"]} -> {log["faces_after"]} triangles (target {target}), '
+              f'{log["error_px"]:.2f} px error')
+        self.profiler.set(lod=log)
 
+    def adjust_materials(self, obj):
         # Add Edge Split modifier
         edge_split = obj.modifiers.new('EdgeSplit', type='EDGE_SPLIT')
 
@@ -309,77 +637,286 @@ class BlenderInterface():
                         # Disable alpha blending
             m.blend_method = 'OPAQUE'
 
+    def import_mesh(self, fpath):
+        # preprocessed meshes are loaded from the cache if available
+        obj = None
+        if self.mesh_cache is not None:
+            with self.profiler.stage('cache'):
+                # the level of detail depends on the resolution the mesh is rendered at
+                object_config = self.config['object']
+                if object_config.get('lod', {}).get('enable', False):
+                    object_config = dict(object_config, camera=self.config['rendering']['camera'])
+                cache_key = self.mesh_cache.key(fpath, object_config)
+                obj = self.mesh_cache.load(cache_key)
+        self.profiler.set(cached=obj is not None)
+
+        if obj is None:
+            with self.profiler.stage('import'):
+                obj = self.load_mesh_file(fpath)
+            with self.profiler.stage('normalize'):
+                self.normalize_object(obj)
+            if self.config['object'].get('lod', {}).get('enable', False):
+                with self.profiler.stage('lod'):
+                    self.decimate_object(obj)
+            with self.profiler.stage('materials'):
+                self.adjust_materials(obj)
+            if self.mesh_cache is not None:
+                with self.profiler.stage('cache'):
+                    self.mesh_cache.store(cache_key, obj)
+        self.profiler.set(source=fpath, vertices=len(obj.data.vertices), faces=len(obj.data.polygons))
+
         self.obj = obj
 
-        self.setup_fog()
+        with self.profiler.stage('fog'):
+            self.setup_fog()
 
         bpy.ops.object.select_all(action='DESELECT')
 
+    def get_output_formats(self):
+        rendering = self.config['rendering']
+        formats = list(rendering.get('output_formats', ['PNG']))
+        for fmt in formats:
+            if fmt == 'OPEN_EXR_MULTILAYER':
+                raise ValueError('OPEN_EXR_MULTILAYER is no output format, the EXR passes are configured with '
+                                 'rendering.use_exr & rendering.exr')
+            if fmt not in FILE_EXTENSIONS:
+                raise ValueError(f'Unsupported output format {fmt}, expected one of {list(FILE_EXTENSIONS)}')
+        return formats
+
+    # Save the last render result once per output format, without rendering again
+    def save_render_result(self, file_path, formats, views=None):
+        scene = bpy.context.scene
+        output = self.config.get('output', {})
+        render_result = bpy.data.images['Render Result']
+        # with multiview every view is saved to its own file, named with the view's suffix
+        suffixes = [''] if views is None else [v.camera_suffix for v in views]
+        written = []
+        for fmt in formats:
+            scene.render.image_settings.file_format = fmt
+            if fmt == 'PNG':
+                scene.render.image_settings.color_depth = output.get('png_color_depth', '8')
+                # the background writer compresses the PNGs, Blender only stores them
+                scene.render.image_settings.compression = output.get('png_compression', 15) \
+                    if self.output_writer is None else 0
+            path = '{}.{}'.format(os.path.abspath(file_path), FILE_EXTENSIONS[fmt])
+            targets = ['{}{}.{}'.format(os.path.abspath(file_path), s, FILE_EXTENSIONS[fmt]) for s in suffixes]
+            if self.output_writer is None:
+                render_result.save_render(filepath=path, scene=scene)
+            else:
+                staged, ext = os.path.splitext(self.output_writer.staging_path(path))
+                render_result.save_render(filepath=staged + ext, scene=scene)
+                for suffix, target in zip(suffixes, targets):
+                    self.output_writer.submit_file(staged + suffix + ext, target)
+            written += targets
+        return written
+
+    # Run a small write on the background writer if there is one
+    def write_output(self, fn, *args):
+        if self.output_writer is None:
+            fn(*args)
+        else:
+            self.output_writer.submit(fn, *args)
+
+    # Which passes are written to the EXR files with which precision & codec, see rendering.exr in the README
+    def get_exr_spec(self):
+        exr = self.config['rendering'].get('exr', {})
+        spec = {
+            'passes': list(exr.get('passes', ['combined', 'z', 'normal', 'cryptomatte_object'])),
+            'codec': exr.get('codec', 'ZIP'),
+            'crop_to_object': exr.get('crop_to_object', False),
+        }
+        precision = exr.get('precision', 'full')
+        if not isinstance(precision, dict):
+            precision = {'default': precision}
+        spec['precision'] = {p: precision.get(p, precision.get('default', 'full')) for p in spec['passes']}
+
+        for p in spec['passes']:
+            if p not in EXR_PASSES:
+                raise ValueError(f'Unsupported EXR pass {p}, expected one of {list(EXR_PASSES)}')
+            if spec['precision'][p] not in EXR_PRECISION:
+                raise ValueError(f'Unsupported EXR precision {spec["precision"][p]}, expected half or full')
+        if spec['codec'] not in EXR_CODECS:
+            raise ValueError(f'Unsupported EXR codec {spec["codec"]}, expected one of {EXR_CODECS}')
+        return spec
+
+    # Enable only the passes that are written & build one multilayer file output node per precision
+    def setup_exr_output(self):
+        scene = bpy.context.scene
+        view_layer = scene.view_layers["ViewLayer"]
+        spec = self.get_exr_spec() if self.config['rendering']['use_exr'] else {'passes': []}
+        for name, (setting, _) in EXR_PASSES.items():
+            # the fog needs the mist pass even if it is not written
+            if setting is not None and not (name == 'mist' and self.config['rendering']['fog']['enable']):
+                setattr(view_layer, setting, name in spec['passes'])
+        if self.exr is not None and self.exr['spec'] == spec:
+            return
+
+        self.remove_exr_output()
+        scene.use_nodes = True
+        nodes = scene.node_tree.nodes
+        self.exr = {'spec': spec, 'outputs': {}, 'crops': []}
+        if not spec['passes']:
+            return
+        for precision in sorted(set(spec['precision'].values())):
+            output = nodes.new('CompositorNodeOutputFile')
+            output.format.file_format = 'OPEN_EXR_MULTILAYER'
+            output.format.color_depth = EXR_PRECISION[precision]
+            output.format.exr_codec = spec['codec']
+            # with multiview all views of the rig go into one multiview EXR, individual files would get view suffixes
+            output.format.views_format = 'INDIVIDUAL' if self.camera['views'] is None else 'MULTIVIEW'
+            output.layer_slots.clear()
+            for p in [p for p in spec['passes'] if spec['precision'][p] == precision]:
+                for socket in EXR_PASSES[p][1]:
+                    output.layer_slots.new(socket)
+                    source = nodes['Render Layers'].outputs[socket]
+                    if spec['crop_to_object']:
+                        crop = nodes.new('CompositorNodeCrop')
+                        crop.relative = False
+                        crop.use_crop_size = True
+                        scene.node_tree.links.new(source, crop.inputs['Image'])
+                        source = crop.outputs['Image']
+                        self.exr['crops'].append(crop)
+                    scene.node_tree.links.new(source, output.inputs[socket])
+            self.exr['outputs'][precision] = output
+
+    def remove_exr_output(self):
+        if self.exr is not None:
+            for node in list(self.exr['outputs'].values()) + self.exr['crops']:
+                bpy.context.scene.node_tree.nodes.remove(node)
+            self.exr = None
+
+    # Pixel window [x_min, y_min, x_max, y_max) of the object's bounding box in every view, y pointing down
+    def get_crop_windows(self, cam2world, K, im_w, im_h, margin=2):
+        v_mat = np.asarray(self.obj.matrix_world, dtype=np.float64)
+        corners = np.array([list(c) for c in self.obj.bound_box], dtype=np.float64) @ v_mat[:3, :3].T + v_mat[:3, 3]
+        world2cam = np.linalg.inv(cam2world)
+        points = np.einsum('ncij,kj->ncki', world2cam[..., :3, :3], corners) + world2cam[..., None, :3, 3]
+        pixels = np.einsum('ij,nckj->ncki', np.asarray(K), points)
+        pixels = pixels[..., :2] / pixels[..., 2:]
+        windows = np.concatenate([np.floor(pixels.min(axis=2)) - margin, np.ceil(pixels.max(axis=2)) + margin], axis=-1)
+        return np.clip(windows, 0, [im_w, im_h, im_w, im_h]).astype(np.int64)
+
+    # Point the EXR file outputs of the next render to file_path & crop them to the window of the view. With multiview
+    # a multilayer EXR holds the passes of all views of the rig
+    def prepare_exr_output(self, file_path, window, im_h):
+        staged = {}
+        for precision, output in self.exr['outputs'].items():
+            base_path = file_path if len(self.exr['outputs']) == 1 else f'{file_path}_{precision}'
+            target = base_path + '.exr'
+            if self.output_writer is not None:
+                base_path = self.output_writer.staging_path(base_path)
+            output.base_path = base_path + '_'
+            # the file output appends the frame number
+            staged[target] = f'{base_path}_{bpy.context.scene.frame_current:04d}.exr'
+        if window is not None:
+            for crop in self.exr['crops']:
+                # compositor pixels start at the bottom of the image
+                crop.min_x, crop.max_x = int(window[0]), int(window[2])
+                crop.min_y, crop.max_y = int(im_h - window[3]), int(im_h - window[1])
+        return staged
+
+    def move_exr_output(self, staged):
+        for target, path in staged.items():
+            if self.output_writer is not None:
+                self.output_writer.submit_file(path, target)
+            else:
+                os.replace(path, target)
+        return list(staged.keys())
+
     def render(self, instance_name, positions, write_cam_params=False):
-        bpy.context.scene.view_layers["ViewLayer"].use_pass_z = True
-        bpy.context.scene.view_layers["ViewLayer"].use_pass_normal = True
-        bpy.context.scene.view_layers["ViewLayer"].use_pass_cryptomatte_object = True
+        self.setup_exr_output()
+        self.profiler.set(instance=instance_name)
 
         # Create the output directory
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
         obj_dir = os.path.join(self.out_dir, instance_name)
         os.makedirs(obj_dir, exist_ok=True)
+        # the instance only counts as finished once all its views are written again
+        manifest.remove_manifest(obj_dir)
+        written_files = []
 
         im_w = bpy.context.scene.render.resolution_x
         im_h = bpy.context.scene.render.resolution_y
 
+        # compute the poses of all cameras at every position up front
+        with self.profiler.stage('poses'):
+            cam2world = util.get_camera_poses(positions, self.camera['offsets'])
+        write_pose_txt = self.config['rendering'].get('write_pose_txt', False)
+
+        K = np.array(util.get_calibration_matrix_K_from_blender(self.camera['cams'][0].data))
+        views = self.camera['views']
+        windows = None
+        if self.exr['outputs'] and self.exr['spec']['crop_to_object']:
+            windows = self.get_crop_windows(cam2world, K, im_w, im_h)
+            if views is not None:
+                # all views of a multiview render share the crop nodes, they are cropped to the union of the windows
+                union = np.concatenate([windows[..., :2].min(axis=1), windows[..., 2:].max(axis=1)], axis=-1)
+                windows[:] = union[:, None]
+
         if write_cam_params:
             img_dir = os.path.join(obj_dir, 'rgb')
             pose_dir = os.path.join(obj_dir, 'pose')
 
             util.cond_mkdir(img_dir)
-            util.cond_mkdir(pose_dir)
-
-            K = util.get_calibration_matrix_K_from_blender(self.camera['cams'][0].data)
-            im_w = bpy.context.scene.render.resolution_x
-            im_h = bpy.context.scene.render.resolution_y
-            with open(os.path.join(obj_dir, 'intrinsics.txt'), 'w') as intrinsics_file:
-                intrinsics_file.write('%f %f %f 0.\n' % (K[0][0], K[0][2], K[1][2]))
-                intrinsics_file.write('0. 0. 0.\n')
-                intrinsics_file.write('1.\n')
-                intrinsics_file.write('%d %d\n' % (im_h, im_w))
+            if write_pose_txt:
+                util.cond_mkdir(pose_dir)
+
+            with self.profiler.stage('write'):
+                # all camera poses of the instance in a single file
+                written_files.append(os.path.join(obj_dir, 'poses.npz'))
+                self.write_output(util.write_poses, written_files[-1], cam2world, K, im_h, im_w, windows)
+                written_files.append(os.path.join(obj_dir, 'intrinsics.txt'))
+                self.write_output(util.write_intrinsics, written_files[-1], K, im_h, im_w)
         else:
             img_dir = self.out_dir
             util.cond_mkdir(img_dir)
 
-        # whether to generate EXR or not
-        use_exr = self.config['rendering']['use_exr']
+        # file formats written for every view, all from the same render
+        output_formats = self.get_output_formats()
 
-        bpy.context.scene.frame_set(0)
         for i, pos in enumerate(positions):
+            # the render call evaluates the new location, no keyframes needed
             self.camera['root'].location = pos
-            self.camera['root'].keyframe_insert(data_path="location", frame=i)
-            # Now we need to render as many times as we have cameras
-            for idx, camera in enumerate(self.camera['cams']):
+            # Now we need to render as many times as we have cameras, with multiview a single render covers the rig
+            if views is None:
+                shots = [([idx], camera, f'{i:06d}_{idx}') for idx, camera in enumerate(self.camera['cams'])]
+            else:
+                shots = [(list(range(len(self.camera['cams']))), self.camera['cams'][0], f'{i:06d}')]
+            for idxs, camera, name in shots:
                 bpy.context.scene.camera = camera
-                file_path = os.path.join(img_dir, f'{i:06d}_{idx}')
-                # set current frame
-                bpy.context.scene.frame_set(i)
-                if use_exr:
-                    # render EXR
-                    bpy.context.scene.render.image_settings.file_format = 'OPEN_EXR_MULTILAYER'
-                    bpy.context.scene.render.filepath = '{}.{}'.format(os.path.abspath(file_path), 'exr')
-                    bpy.ops.render.render(write_still=True)
-                # render PNG
-                bpy.context.scene.render.image_settings.file_format = 'PNG'
-                bpy.context.scene.render.filepath = '{}.{}'.format(os.path.abspath(file_path), 'png')
-                bpy.ops.render.render(write_still=True)
-
-                if write_cam_params:
-                    # Write out camera pose
-                    RT = util.get_world2cam_from_blender_cam(camera)
-                    cam2world = RT.inverted()
-                    with open(os.path.join(pose_dir, f'{i:06d}_{idx}.txt'), 'w') as pose_file:
-                        matrix_flat = []
-                        for j in range(4):
-                            for k in range(4):
-                                matrix_flat.append(cam2world[j][k])
-                        pose_file.write(' '.join(map(str, matrix_flat)) + '\n')
-
-        bpy.data.objects.remove(self.obj)
+                file_path = os.path.join(img_dir, name)
+                # the file output nodes write the EXR passes during the render
+                exr_files = self.prepare_exr_output(file_path, None if windows is None else windows[i, idxs[0]], im_h)
+                # render once and save the result in every output format
+                with self.profiler.stage('render'):
+                    bpy.ops.render.render()
+                with self.profiler.stage('write'):
+                    written_files += self.move_exr_output(exr_files)
+                    written_files += self.save_render_result(file_path, output_formats, views)
+
+                    if write_cam_params and write_pose_txt:
+                        # Write out camera pose in the legacy per-view format
+                        for idx in idxs:
+                            written_files.append(os.path.join(pose_dir, f'{i:06d}_{idx}.txt'))
+                            self.write_output(util.write_pose_txt, written_files[-1], cam2world[i, idx])
+
+        # all files of the instance have to be written before they are counted, packed & listed in the manifest
+        if self.output_writer is not None:
+            with self.profiler.stage('flush'):
+                self.output_writer.flush()
+
+        self.profiler.add(views=len(positions) * len(self.camera['cams']),
+                          output_bytes=sum(os.path.getsize(f) for f in written_files))
+        shard = None
+        writer = self.get_shard_writer()
+        if writer is not None and write_cam_params:
+            with self.profiler.stage('pack'):
+                shard = writer.add_instance(instance_name, obj_dir, written_files)
+                for f in written_files:
+                    os.remove(f)
+                for d in [img_dir, pose_dir]:
+                    if os.path.isdir(d) and not os.listdir(d):
+                        os.rmdir(d)
+        manifest.write_manifest(obj_dir, self.config, len(positions) * len(self.camera['cams']), written_files,
+                                shard=shard)
@@ -0,0 +1,397 @@
+import io
+import os
+import re
+import json
+import hashlib
+import argparse
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import manifest
+import shard_writer
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import OpenEXR
+except ImportError:
+    OpenEXR = None
+
+INDEX_VERSION = 2
+IMAGE_EXTENSIONS = ['png', 'jpg', 'tif']
+# EXR files of a view, a single file or one per precision
+EXR_SUFFIXES = ['', '_half', '_full']
+# views of a multiview render of the MVS rig
+MULTIVIEW_NAME = re.compile(r'camera_\d+')
+# save_render names the layers ViewLayer.<pass>, the file output nodes after the Render Layers sockets
+LAYER_NAMES = {'Combined': 'Image'}
+COMPONENT_ORDER = 'RGBAXYZUVW'
+DEFAULT_FIELDS = ('rgb', 'cam2world', 'intrinsics')
+
+
+def default_index_dir(root):
+    """Like the model index of discovery.py, the dataset index is kept in the user's cache."""
+    key = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser('~'), '.cache', 'shapenet_renderer', f'reader_{key}')
+
+
+def decode_image(data, ext):
+    if cv2 is not None:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f'Could not decode .{ext} image')
+        if image.ndim == 3 and image.shape[2] >= 3:
+            # OpenCV orders the channels BGR(A)
+            image = image[..., [2, 1, 0, 3][:image.shape[2]]]
+        return image
+    # Pillow only keeps 8 bits per channel of color PNGs
+    if Image is not None and not (ext == 'png' and data[24] == 16):
+        with Image.open(io.BytesIO(data)) as image:
+            return np.asarray(image)
+    raise ImportError(f'Reading .{ext} files needs OpenCV, or Pillow for 8 bit images, '
+                      f'install it with pip install opencv-python')
+
+
+def decode_exr(path, view=None):
+    """Reads all layers of a (multilayer) EXR as a dict from layer name to an array of shape (height, width, C).
+
+    Multiview EXRs of the MVS rig name the channels of every view but the first one after it, e.g.
+    Depth.camera_1.V, view selects the channels of one view.
+    """
+    if OpenEXR is None:
+        raise ImportError('Reading EXR files needs the OpenEXR package, install it with pip install OpenEXR')
+    with OpenEXR.File(path, separate_channels=True) as f:
+        channels = {name: np.array(c.pixels) for name, c in f.channels().items()}
+    layers = {}
+    for name, pixels in channels.items():
+        tokens = name.split('.')
+        views = [t for t in tokens if MULTIVIEW_NAME.fullmatch(t)]
+        if view is not None and (views[0] if views else 'camera_0') != view:
+            continue
+        tokens = [t for t in tokens if t not in views]
+        layer, component = '.'.join(tokens[:-1]), tokens[-1]
+        layer = layer.split('.')[-1]
+        layers.setdefault(LAYER_NAMES.get(layer, layer), {})[component] = pixels
+    order = lambda k: (k not in COMPONENT_ORDER, COMPONENT_ORDER.find(k), k)
+    return {layer: np.stack([c[k] for k in sorted(c, key=order)], axis=-1) for layer, c in layers.items()}
+
+
+def find_instances(root):
+    """Relative paths of all instance directories below root that have a manifest, e.g. of several variants."""
+    instances = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if manifest.MANIFEST_FILE in filenames:
+            instances.append(os.path.relpath(dirpath, root).replace(os.sep, '/'))
+            # the outputs of an instance never contain other instances
+            dirnames[:] = []
+        else:
+            dirnames[:] = sorted(d for d in dirnames if d != shard_writer.SHARD_DIR)
+    return sorted(instances)
+
+
+def read_shard_index(path):
+    """Offset & size of the members of a shard, grouped by instance."""
+    members = {}
+    with open(path + shard_writer.INDEX_SUFFIX, 'r') as f:
+        for line in f:
+            e = json.loads(line)
+            # an instance rendered again is appended, the last copy wins
+            members.setdefault(e['instance'], {})[e['name']] = [e['offset'], e['size']]
+    return members
+
+
+def scan_instance(root, name, shard_indices, lock):
+    obj_dir = os.path.join(root, name)
+    m = manifest.read_manifest(obj_dir)
+    if m is None or m['num_views'] == 0 or 'poses.npz' not in m['files']:
+        return None
+    entry = {'name': name, 'shard': None}
+    if 'shard' in m:
+        shard_path = os.path.normpath(os.path.join(obj_dir, m['shard']['path']))
+        with lock:
+            if shard_path not in shard_indices:
+                shard_indices[shard_path] = read_shard_index(shard_path)
+        # members are stored under the instance path relative to the out_dir holding the shards
+        instance = os.path.relpath(obj_dir, os.path.dirname(os.path.dirname(shard_path))).replace(os.sep, '/')
+        members = shard_indices[shard_path].get(instance, {})
+        entry['shard'] = {'path': os.path.relpath(shard_path, root), 'members': members}
+        start, size = members['poses.npz']
+        poses = np.load(io.BytesIO(shard_writer.read_member(shard_path, start, size)))
+    else:
+        poses = np.load(os.path.join(obj_dir, 'poses.npz'))
+
+    cam2world = poses['cam2world']
+    entry['views'], entry['cameras'] = cam2world.shape[:2]
+    files = set(m['files'])
+    entry['image'] = next((ext for ext in IMAGE_EXTENSIONS if f'rgb/000000_0.{ext}' in files), None)
+    entry['exr'] = [s for s in EXR_SUFFIXES if f'rgb/000000_0{s}.exr' in files]
+    # with multiview one EXR holds all cameras of a position
+    entry['exr_multiview'] = not entry['exr'] and any(f'rgb/000000{s}.exr' in files for s in EXR_SUFFIXES)
+    if entry['exr_multiview']:
+        entry['exr'] = [s for s in EXR_SUFFIXES if f'rgb/000000{s}.exr' in files]
+    crop = poses['crop'] if 'crop' in poses.files else None
+    return entry, cam2world, poses['intrinsics'], poses['resolution'], crop
+
+
+def build_index(root, index_dir=None, num_workers=16):
+    """Indexes all rendered instances below root once.
+
+    The instances & their files go to index.json, the camera poses of all views are concatenated into arrays that
+    are memory-mapped when reading.
+    """
+    index_dir = index_dir or default_index_dir(root)
+    shard_indices, lock = {}, threading.Lock()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        scans = list(executor.map(lambda n: scan_instance(root, n, shard_indices, lock), find_instances(root)))
+    scans = [s for s in scans if s is not None]
+
+    instances, start = [], 0
+    for entry, cam2world, _, _, _ in scans:
+        entry['start'] = start
+        start += entry['views'] * entry['cameras']
+        instances.append(entry)
+    cam2world = np.concatenate([s[1].reshape(-1, 4, 4) for s in scans]) if scans else np.zeros((0, 4, 4))
+    resolution = np.array([s[3] for s in scans]).reshape(-1, 2)
+    crop = []
+    for entry, _, _, (im_h, im_w), view_crop in scans:
+        # views without a crop window cover the whole image
+        full = np.tile([0, 0, im_w, im_h], (entry['views'] * entry['cameras'], 1))
+        crop.append(full if view_crop is None else view_crop.reshape(-1, 4))
+
+    os.makedirs(index_dir, exist_ok=True)
+    arrays = {
+        'cam2world': cam2world.astype(np.float64),
+        'intrinsics': np.array([s[2] for s in scans]).reshape(-1, 3, 3),
+        'resolution': resolution,
+        'crop': np.concatenate(crop).astype(np.int64) if crop else np.zeros((0, 4), dtype=np.int64),
+        'view_instance': np.repeat(np.arange(len(instances)), [e['views'] * e['cameras'] for e in instances]),
+    }
+    for key, value in arrays.items():
+        write_atomic(os.path.join(index_dir, f'{key}.npy'), lambda f: np.save(f, value))
+    # written last, an index without it is rebuilt
+    index = {'version': INDEX_VERSION, 'root': os.path.abspath(root), 'instances': instances}
+    write_atomic(os.path.join(index_dir, 'index.json'), lambda f: f.write(json.dumps(index).encode('utf-8')))
+    return index_dir
+
+
+def write_atomic(path, write):
+    # a temporary file per writer, readers building the same index at the same time never share it
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def load_index(index_dir, root):
+    try:
+        with open(os.path.join(index_dir, 'index.json'), 'r') as f:
+            index = json.load(f)
+        if index['version'] == INDEX_VERSION and index['root'] == os.path.abspath(root):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def sample_bytes(value, seen=None):
+    """Memory held by the arrays of a sample, including nested dicts & the arrays that views keep alive."""
+    seen = set() if seen is None else seen
+    if isinstance(value, dict):
+        return sum(sample_bytes(v, seen) for v in value.values())
+    if not isinstance(value, np.ndarray):
+        return 0
+    while isinstance(value.base, np.ndarray):
+        value = value.base
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    return value.nbytes
+
+
+class LRUCache():
+    """Keeps the most recently read samples up to a total size of max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.num_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key][0]
+
+    def put(self, key, value):
+        size = sample_bytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.num_bytes -= self.items.pop(key)[1]
+            self.items[key] = (value, size)
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                self.num_bytes -= self.items.popitem(last=False)[1][1]
+
+
+class Dataset():
+    """Random access to the views rendered below root, e.g. out_dir, by BlenderInterface.render.
+
+    The index is built on first use and reused afterwards, pass rebuild=True after rendering more instances. A sample
+    is a dict with the requested fields out of rgb, depth, normal, exr (all EXR layers), cam2world, world2cam,
+    intrinsics & crop plus instance, view & camera. Poses come from memory-mapped arrays, images are only read when
+    a sample is requested and decoded on num_workers threads by load_many & iterate. Decoded samples are kept in an
+    LRU cache of cache_mb. Works as a map-style dataset, e.g. for torch.utils.data.DataLoader.
+    """
+
+    def __init__(self, root, fields=DEFAULT_FIELDS, index_dir=None, rebuild=False, num_workers=8, cache_mb=1024):
+        self.root = os.path.abspath(root)
+        self.fields = tuple(fields)
+        index_dir = index_dir or default_index_dir(root)
+        index = None if rebuild else load_index(index_dir, root)
+        if index is None:
+            build_index(root, index_dir, num_workers)
+            index = load_index(index_dir, root)
+        self.instances = index['instances']
+        arrays = ['cam2world', 'intrinsics', 'resolution', 'crop', 'view_instance']
+        self.arrays = {key: np.load(os.path.join(index_dir, f'{key}.npy'), mmap_mode='r') for key in arrays}
+        self.cache = LRUCache(cache_mb * 2 ** 20) if cache_mb > 0 else None
+        self.num_workers = num_workers
+        self.executor = None
+
+    def __len__(self):
+        return len(self.arrays['view_instance'])
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        key = (idx, self.fields)
+        sample = self.cache.get(key) if self.cache is not None else None
+        if sample is None:
+            sample = self.read_sample(idx)
+            if self.cache is not None:
+                self.cache.put(key, sample)
+        return sample
+
+    def instance_views(self, name):
+        """Indices of all views of an instance."""
+        entry = next(e for e in self.instances if e['name'] == name)
+        return range(entry['start'], entry['start'] + entry['views'] * entry['cameras'])
+
+    def read_file(self, entry, name):
+        if entry['shard'] is None:
+            with open(os.path.join(self.root, entry['name'], name), 'rb') as f:
+                return f.read()
+        offset, size = entry['shard']['members'][name]
+        return shard_writer.read_member(os.path.join(self.root, entry['shard']['path']), offset, size)
+
+    def read_exr(self, entry, view, camera):
+        prefix, exr_view = f'rgb/{view:06d}_{camera}', None
+        if entry.get('exr_multiview'):
+            prefix, exr_view = f'rgb/{view:06d}', f'camera_{camera}'
+        layers = {}
+        for suffix in entry['exr']:
+            name = f'{prefix}{suffix}.exr'
+            if entry['shard'] is None:
+                layers.update(decode_exr(os.path.join(self.root, entry['name'], name), exr_view))
+                continue
+            # OpenEXR only reads files
+            with tempfile.NamedTemporaryFile(suffix='.exr') as f:
+                f.write(self.read_file(entry, name))
+                f.flush()
+                layers.update(decode_exr(f.name, exr_view))
+        return layers
+
+    def read_sample(self, idx):
+        instance = int(self.arrays['view_instance'][idx])
+        entry = self.instances[instance]
+        view, camera = divmod(idx - entry['start'], entry['cameras'])
+        sample = {'instance': entry['name'], 'view': view, 'camera': camera}
+        cam2world = np.array(self.arrays['cam2world'][idx])
+        if 'cam2world' in self.fields:
+            sample['cam2world'] = cam2world
+        if 'world2cam' in self.fields:
+            sample['world2cam'] = np.linalg.inv(cam2world)
+        if 'intrinsics' in self.fields:
+            sample['intrinsics'] = np.array(self.arrays['intrinsics'][instance])
+        if 'crop' in self.fields:
+            sample['crop'] = np.array(self.arrays['crop'][idx])
+
+        prefix = f'rgb/{view:06d}_{camera}'
+        needs_exr = any(f in self.fields for f in ['depth', 'normal', 'exr']) or \
+            ('rgb' in self.fields and entry['image'] is None)
+        layers = self.read_exr(entry, view, camera) if needs_exr and entry['exr'] else {}
+        if 'rgb' in self.fields:
+            if entry['image'] is not None:
+                sample['rgb'] = decode_image(self.read_file(entry, f'{prefix}.{entry["image"]}'), entry['image'])
+            elif 'Image' in layers:
+                sample['rgb'] = layers['Image']
+        if 'depth' in self.fields and 'Depth' in layers:
+            # a copy, a view would keep all channels of the layer alive
+            sample['depth'] = np.ascontiguousarray(layers['Depth'][..., 0])
+        if 'normal' in self.fields and 'Normal' in layers:
+            sample['normal'] = layers['Normal']
+        if 'exr' in self.fields:
+            sample['exr'] = layers
+        return sample
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
+        return self.executor
+
+    def load_many(self, indices):
+        """Reads the samples in parallel, the image decoders release the GIL."""
+        return list(self.get_executor().map(self.__getitem__, indices))
+
+    def iterate(self, indices=None, prefetch=32):
+        """Yields the samples in order while up to prefetch of the following ones are decoded in the background."""
+        it = iter(range(len(self)) if indices is None else indices)
+        executor = self.get_executor()
+        pending = deque(executor.submit(self.__getitem__, i) for _, i in zip(range(prefetch), it))
+        while pending:
+            sample = pending.popleft().result()
+            for i in it:
+                pending.append(executor.submit(self.__getitem__, i))
+                break
+            yield sample
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def main():
+    p = argparse.ArgumentParser(description='Indexes the views rendered below a directory for the dataset reader.')
+    p.add_argument('root', type=str, help='Output directory of the renderer.')
+    p.add_argument('--index_dir', type=str, default=None, help='Directory of the index.')
+    p.add_argument('--num_workers', type=int, default=16, help='Number of instances indexed in parallel.')
+    opt = p.parse_args()
+
+    index_dir = build_index(opt.root, opt.index_dir, opt.num_workers)
+    dataset = Dataset(opt.root, index_dir=index_dir)
+    print(f'{len(dataset.instances)} instances with {len(dataset)} views indexed in {index_dir}')
+
+
+if __name__ == '__main__':
+    main()
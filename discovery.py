@@ -0,0 +1,161 @@
+import os
+import json
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+EXTENSIONS = ('.gltf', '.glb', '.obj', '.ply')
+# File names that do not identify a model, e.g. ShapeNet's synset/model_id/models/model_normalized.obj
+GENERIC_NAMES = {'model_normalized', 'model', 'mesh', 'scene', 'textured'}
+# Directories that only hold the files of a model
+GENERIC_DIRS = {'models', 'model', 'meshes'}
+INDEX_VERSION = 2
+
+
+def default_index_path(root):
+    """Index files are kept in the user's cache so that read-only dataset trees can be indexed too."""
+    key = hashlib.sha1(os.path.abspath(root).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser('~'), '.cache', 'shapenet_renderer', f'index_{key}.json')
+
+
+def instance_id(relpath, collapse=True):
+    """Derives a unique instance id from the path of a model relative to the root.
+
+    Generic file names and model sub-directories are dropped, so ShapeNet's
+    synset/model_id/models/model_normalized.obj becomes synset/model_id while a flat
+    directory of chair.obj files keeps using the file names. With collapse=False the
+    file name is always kept.
+    """
+    parts = relpath.replace(os.sep, '/').split('/')
+    name = os.path.splitext(parts[-1])[0]
+    dirs = parts[:-1]
+    if not collapse or name.lower() not in GENERIC_NAMES or not dirs:
+        return '/'.join(dirs + [name])
+    while len(dirs) > 1 and dirs[-1].lower() in GENERIC_DIRS:
+        dirs = dirs[:-1]
+    return '/'.join(dirs)
+
+
+def scan_dir(root, reldir, cached, verify_files=False):
+    """Lists a single directory, an unchanged directory mtime means the cached listing is still valid."""
+    path = os.path.join(root, reldir)
+    st = os.stat(path)
+    mtime = st.st_mtime_ns
+    # identifies the directory behind symlinks
+    dir_id = [st.st_dev, st.st_ino]
+    if cached is not None and cached['mtime'] == mtime:
+        if not verify_files:
+            return dict(cached, id=dir_id)
+        files = {}
+        for name in cached['files']:
+            st = os.stat(os.path.join(path, name))
+            files[name] = [st.st_size, st.st_mtime_ns]
+        return dict(cached, files=files, id=dir_id)
+
+    files, subdirs, links = {}, [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                (links if entry.is_symlink() else subdirs).append(entry.name)
+            elif entry.name.lower().endswith(EXTENSIONS):
+                st = entry.stat()
+                files[entry.name] = [st.st_size, st.st_mtime_ns]
+    return {'mtime': mtime, 'files': files, 'subdirs': sorted(subdirs), 'links': sorted(links), 'id': dir_id}
+
+
+def load_index(index_path, root):
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index['version'] == INDEX_VERSION and index['root'] == os.path.abspath(root):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    return {'version': INDEX_VERSION, 'root': os.path.abspath(root), 'dirs': {}}
+
+
+def save_index(index_path, index):
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    os.makedirs(index_dir, exist_ok=True)
+    # every --shard process updates the same index, each writes its own temporary file
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=os.path.basename(index_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def discover(root, index_path=None, num_workers=16, verify_files=False):
+    """Walks the tree below root in parallel and returns the models found as dicts with id, path and size.
+
+    The listing of every directory is cached in an index, later runs only re-list directories whose mtime changed.
+    """
+    index_path = index_path or default_index_path(root)
+    index = load_index(index_path, root)
+    cached_dirs = index['dirs']
+    dirs = {}
+
+    # breadth-first, all directories of one level are scanned in parallel
+    frontier = ['']
+    # directories reached through symlinks are only listed once, symlink loops would never end otherwise
+    visited = set()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        while frontier:
+            listings = executor.map(lambda d: scan_dir(root, d, cached_dirs.get(d), verify_files), frontier)
+            next_frontier, next_links = [], []
+            for reldir, listing in zip(frontier, listings):
+                if tuple(listing['id']) in visited:
+                    continue
+                visited.add(tuple(listing['id']))
+                dirs[reldir] = listing
+                next_frontier += [os.path.join(reldir, s) for s in listing['subdirs']]
+                next_links += [os.path.join(reldir, s) for s in listing['links']]
+            # a directory reached both directly & through a symlink keeps its real path
+            frontier = next_frontier + next_links
+
+    index['dirs'] = dirs
+    save_index(index_path, index)
+
+    models = []
+    used_ids = set()
+    for reldir in sorted(dirs):
+        files = dirs[reldir]['files']
+        for name, (size, mtime) in sorted(files.items()):
+            relpath = os.path.join(reldir, name)
+            # generic names only identify a model when it is the only one in its directory
+            model_id = instance_id(relpath, collapse=len(files) == 1)
+            if model_id in used_ids:
+                model_id = instance_id(os.path.join(reldir, name.replace('.', '_')), collapse=False)
+            used_ids.add(model_id)
+            models.append({'id': model_id, 'path': os.path.join(os.path.abspath(root), relpath), 'size': size})
+
+    # an id must not be a parent directory of another id, e.g. a/model.obj next to a/b/chair.obj,
+    # otherwise the outputs of one instance end up inside the directory of the other
+    parents = {model['id'].rsplit('/', i)[0] for model in models for i in range(1, model['id'].count('/') + 1)}
+    for model in models:
+        if model['id'] in parents:
+            reldir, name = os.path.split(os.path.relpath(model['path'], os.path.abspath(root)))
+            model['id'] = instance_id(os.path.join(reldir, name.replace('.', '_')), collapse=False)
+    return models
+
+
+def main():
+    p = argparse.ArgumentParser(description='Lists the 3D models below a directory and updates its cached index.')
+    p.add_argument('root', type=str, help='Root directory of the dataset.')
+    p.add_argument('--index', type=str, default=None, help='Path of the index file.')
+    p.add_argument('--num_workers', type=int, default=16, help='Number of directories scanned in parallel.')
+    p.add_argument('--verify_files', action='store_true', help='Also stat files in unchanged directories.')
+    opt = p.parse_args()
+
+    models = discover(opt.root, opt.index, opt.num_workers, opt.verify_files)
+    for m in models:
+        print(m['id'], m['path'])
+    print(f'{len(models)} models found')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,53 +1,113 @@
 import os
 import json
+import random
+import hashlib
 import argparse
-import subprocess
-
-
-def collect_files(directory, extensions):
-    """Collects all files with specified extensions in a given directory."""
-    files = []
-    for f in os.listdir(directory):
-        if f.endswith(tuple(extensions)):
-            files.append(os.path.join(directory, f))
-    return files
-
-
-def distribute_files(files, num_jobs):
-    job_lists = []
-    #job_lists = [[] for _ in range(num_jobs)]
-    total_files = len(files)
-    batch_size = total_files // num_jobs
-    batch_rem = total_files % num_jobs
-    # distribute the files to the number of jobs
-    for job in range(num_jobs):
-        print('from: {}, to: {}'.format(batch_size * job, batch_size * (job + 1)))
-        job_lists.append(files[batch_size * job:batch_size * (job + 1)])
-    # add remainder of files to last job
-    if batch_rem != 0:
-        job_lists[-1].append(files[batch_size * num_jobs:batch_size * num_jobs + batch_rem])
-    return job_lists
-
-
-def save_job_config(root_path, job_lists, output_json):
-    """Saves the job distribution to a JSON file."""
-    job_data = {"root_path": root_path, "files": job_lists}
+import tempfile
+
+import manifest
+import variants
+import discovery
+import placement
+import supervisor
+from job_queue import JobQueue
+
+
+def parse_shard(value):
+    """Parses a shard specification "i/N" into the shard index & the number of shards."""
+    try:
+        index, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Shard must be given as i/N, got {value}')
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'Shard index must be in [0, {count}), got {index}')
+    return index, count
+
+
+def assign_shard(instance_id, num_shards):
+    """Rendezvous hashing on the instance id, models keep their shard when other models are added or removed."""
+    scores = [hashlib.sha1(f'{shard}:{instance_id}'.encode('utf-8')).digest() for shard in range(num_shards)]
+    return max(range(num_shards), key=lambda shard: scores[shard])
+
+
+def select_shard(models, shard):
+    """Returns the models of this shard, most expensive first so that no worker ends the batch with a huge mesh."""
+    index, count = shard
+    costs = [0] * count
+    selected = []
+    for m in models:
+        s = assign_shard(m['id'], count)
+        # the file size is a cheap estimate of the cost to import & render the model
+        costs[s] += m['size']
+        if s == index:
+            selected.append(m)
+    print(f"Shard {index}/{count}: {len(selected)} of {len(models)} models, "
+          f"{costs[index] / max(1, sum(costs)) * 100:.1f}% of the estimated cost")
+    return sorted(selected, key=lambda m: -m['size'])
+
+
+def create_job_queue(root_path, models, output_json):
+    """Fills the shared job queue and saves its location together with the root path to a JSON file."""
+    queue_path = os.path.splitext(os.path.abspath(output_json))[0] + '.sqlite'
+    queue = JobQueue.create(queue_path, [m['path'] for m in models], [m['id'] for m in models])
+    queue.close()
+    job_data = {"root_path": root_path, "queue": queue_path}
     with open(output_json, 'w') as f:
         json.dump(job_data, f, indent=4)
-
-
-def launch_blender_jobs(num_jobs, json_file, blender_script, config_file):
-    """Launches Blender in headless mode with the specified script and job data."""
-    from sys import platform
-    blender = 'blender.exe' if platform == 'win32' else 'blender'
-    for job_id in range(num_jobs):
-        command = [
-            "blender", "--background", "--python", blender_script, "--",
+    return queue_path
+
+
+def launch_blender_jobs(num_jobs, json_file, blender_script, config_file, log_dir, timeout=None, memory_limit_mb=None,
+                        max_attempts=2, max_restarts=10, threads=0, pin='cores'):
+    """Runs Blender in headless mode with the specified script and job data until the queue is drained."""
+    with open(json_file, 'r') as f:
+        queue_path = json.load(f)['queue']
+    placements = placement.plan(num_jobs, threads, pin)
+    commands = []
+    for job_id, p in enumerate(placements):
+        # a Python error in the script makes Blender exit with a non-zero code instead of 0
+        commands.append(placement.command_prefix(p) + [
+            supervisor.blender_executable(), "--background", "--threads", str(p['threads']), "--python-exit-code", "1",
+            "--python", blender_script, "--",
             "--batch_file", json_file, "--batch_id", str(job_id), "--config", config_file
-        ]
-        print(command)
-        subprocess.Popen(command, shell=True)
-        print(f"Started job {job_id} with command: {' '.join(command)}")
+        ])
+        print(f"Job {job_id} command: {' '.join(commands[-1])}" + (f" on CPUs {p['cpus']}" if p['cpus'] else ""))
+    workers = supervisor.Supervisor(queue_path, commands, log_dir, timeout, memory_limit_mb, max_attempts, max_restarts,
+                                    placements=placements)
+    try:
+        return workers.run()
+    finally:
+        workers.close()
+
+
+def autotune(args, models, config):
+    """Renders a sample of the models with several jobs x threads splits and returns the fastest one."""
+    sample = random.Random(0).sample(models, min(args.autotune_models, len(models)))
+    num_cpus = len(placement.available_cpus())
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for jobs, threads in placement.candidate_splits(num_cpus, max_jobs=len(sample)):
+            trial_dir = os.path.join(tmp_dir, f'{jobs}x{threads}')
+            os.makedirs(trial_dir)
+            # every split renders from scratch, without outputs or cached meshes of the previous trials
+            trial_config = dict(config, out_dir=os.path.join(trial_dir, 'out'),
+                                mesh_cache=dict(config.get('mesh_cache', {}), enable=False))
+            config_file = os.path.join(trial_dir, 'config.json')
+            with open(config_file, 'w') as f:
+                json.dump(trial_config, f)
+            json_file = os.path.join(trial_dir, 'jobs.json')
+            queue_path = create_job_queue(args.d, sample, json_file)
+            print(f"Auto-tuning: {jobs} jobs x {threads} threads on {len(sample)} models")
+            launch_blender_jobs(jobs, json_file, args.script, config_file, os.path.join(trial_dir, 'logs'),
+                                args.timeout or None, args.memory_limit_gb * 1024 or None, 1, 0, threads, args.pin)
+            queue = JobQueue(queue_path)
+            results.append((queue.throughput(), jobs, threads))
+            queue.close()
+    for throughput, jobs, threads in results:
+        print(f"  {jobs:>3} jobs x {threads:>3} threads: {throughput:.3f} instances/s")
+    throughput, jobs, threads = max(results)
+    print(f"Using {jobs} jobs x {threads} threads")
+    return jobs, threads
 
 
 def main():
@@ -57,21 +117,72 @@ def main():
     parser.add_argument("--config", type=str, help="Config file to load")
     parser.add_argument("--num_jobs", type=int, default=4, help="Number of parallel jobs (default: 4)")
     parser.add_argument("--output_json", type=str, default="jobs.json", help="JSON file to store job allocation")
+    parser.add_argument("--index", type=str, default=None, help="Cached model index (default: in ~/.cache)")
+    parser.add_argument("--shard", type=parse_shard, default=(0, 1),
+                        help="Only render the i-th of N node shares of the models, given as i/N (default: 0/1)")
+    parser.add_argument("--timeout", type=float, default=3600,
+                        help="Seconds a worker may spend on one instance before it is restarted, 0 disables (default: 3600)")
+    parser.add_argument("--memory_limit_gb", type=float, default=0,
+                        help="Resident memory per worker before it is restarted, 0 disables (default: 0)")
+    parser.add_argument("--max_attempts", type=int, default=2,
+                        help="Failed attempts after which a model is quarantined (default: 2)")
+    parser.add_argument("--max_restarts", type=int, default=10,
+                        help="Restarts of a worker that crashes without finishing an instance (default: 10)")
+    parser.add_argument("--log_dir", type=str, default=None, help="Directory of the worker logs (default: <output_json>_logs)")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Threads per Blender worker (default: the available CPUs divided by --num_jobs)")
+    parser.add_argument("--pin", type=str, default="cores", choices=["none", "cores", "numa"],
+                        help="Pin every worker to its own CPUs, 'numa' also keeps it and its memory on one NUMA node")
+    parser.add_argument("--autotune", action="store_true",
+                        help="Benchmark several jobs x threads splits on a sample of the models and use the fastest")
+    parser.add_argument("--autotune_models", type=int, default=8, help="Models rendered per split when auto-tuning")
+    parser.add_argument("--retry_quarantined", action="store_true", help="Queue the models quarantined by earlier runs again")
 
     args = parser.parse_args()
 
-    extensions = ["gltf", "obj", "ply"]
-    files = collect_files(args.d, extensions)
+    # every node needs its own queue on a shared filesystem
+    if args.shard[1] > 1 and args.output_json == parser.get_default("output_json"):
+        args.output_json = f"jobs_{args.shard[0]}of{args.shard[1]}.json"
 
-    if not files:
+    models = select_shard(discovery.discover(args.d, args.index), args.shard)
+
+    if not models:
         print("No valid 3D model files found. Exiting.")
         return
 
-    job_lists = distribute_files(files, args.num_jobs)
-    save_job_config(args.d, job_lists, args.output_json)
+    # only queue the instances whose outputs are missing or were rendered with another config, for any variant
+    with open(args.config, 'r') as f:
+        config = json.load(f)
+    configs = [c for _, c in variants.expand_variants(config)]
+    num_models = len(models)
+    models = [m for m in models
+              if not all(manifest.is_complete(manifest.instance_dir(c, m['id']), c) for c in configs)]
+    print(f"Skipping {num_models - len(models)} instances that are already rendered")
+    # models that failed repeatedly in earlier runs stay out of the queue until they are fixed
+    quarantine = {} if args.retry_quarantined else supervisor.load_quarantine(args.output_json)
+    num_models = len(models)
+    models = [m for m in models if m['path'] not in quarantine]
+    if num_models > len(models):
+        print(f"Skipping {num_models - len(models)} quarantined instances, see {supervisor.quarantine_path(args.output_json)}")
+    if not models:
+        print("All instances are rendered. Exiting.")
+        return
 
-    print(f"Job configuration saved to {args.output_json}")
-    launch_blender_jobs(args.num_jobs, args.output_json, args.script, args.config)
+    if args.autotune:
+        args.num_jobs, args.threads = autotune(args, models, config)
+
+    queue_path = create_job_queue(args.d, models, args.output_json)
+
+    print(f"Queued {len(models)} files in {queue_path}, job configuration saved to {args.output_json}")
+    log_dir = args.log_dir or os.path.splitext(args.output_json)[0] + '_logs'
+    counts, quarantined = launch_blender_jobs(args.num_jobs, args.output_json, args.script, args.config, log_dir,
+                                              args.timeout or None, args.memory_limit_gb * 1024 or None,
+                                              args.max_attempts, args.max_restarts, args.threads, args.pin)
+    print(f"Queue status: {counts}")
+    for path, instance, attempts, error in quarantined:
+        quarantine[path] = {'path': path, 'instance': instance, 'attempts': attempts, 'error': error}
+        print(f"Quarantined {instance} after {attempts} attempts: {error.strip().splitlines()[-1] if error else ''}")
+    supervisor.save_quarantine(args.output_json, quarantine)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+import os
+import json
+import math
+import random
+
+import bpy
+
+# Equirectangular maps are never downsampled below this width
+MIN_WIDTH = 256
+
+
+class HDRIPool():
+    """Keeps the environment maps listed in hdris/config.json loaded for the whole run.
+
+    Switching the environment only relinks the image of the world's texture node. Every map is kept in a copy whose
+    width matches the angular resolution of the cameras, so small renders do not sample full resolution maps.
+    """
+
+    def __init__(self, directory, preload=False):
+        self.directory = directory
+        with open(os.path.join(directory, 'config.json'), 'r') as f:
+            self.entries = {e['name']: e for e in json.load(f)}
+        # (name, width) -> image, width None is the original map
+        self.images = {}
+        if preload:
+            for name in self.entries:
+                self.get(name)
+
+    def names(self):
+        return list(self.entries.keys())
+
+    def entry(self, name):
+        if name not in self.entries:
+            raise ValueError(f'Could not find {name} in {list(self.entries.keys())}')
+        return self.entries[name]
+
+    def pick(self, name=''):
+        """Returns the entry with the given name, a random one if the name is empty."""
+        return self.entry(name) if name != '' else self.entries[random.choice(self.names())]
+
+    def target_width(self, camera_config, resolution_scale=1.0):
+        """Width of an equirectangular map with about one texel per rendered pixel, rounded up to a power of two."""
+        pixels_per_radian = max(camera_config['width'], camera_config['height']) / camera_config['fov']
+        width = 2 * math.pi * pixels_per_radian * resolution_scale
+        return max(MIN_WIDTH, 2 ** math.ceil(math.log2(width)))
+
+    def load(self, name):
+        image = bpy.data.images.load(os.path.join(self.directory, name), check_existing=True)
+        image.colorspace_settings.name = 'Non-Color'
+        # keep the image when the orphan data of an instance is purged
+        image.use_fake_user = True
+        return image
+
+    def get(self, name, width=None):
+        """Returns the map downsampled to the given width, or the original if it is not wider."""
+        key = (name, width)
+        if key in self.images:
+            return self.images[key]
+        original = self.images.get((name, None)) or self.load(name)
+        self.images[(name, None)] = original
+        if width is None or original.size[0] <= width:
+            self.images[key] = original
+            return original
+        print(f'Downsampling {name} from {original.size[0]} to {width} pixels')
+        image = original.copy()
+        image.name = f'{os.path.splitext(name)[0]}_{width}'
+        image.scale(width, width // 2)
+        # pack the scaled pixels so that Blender does not reload the file from disk
+        image.pack()
+        image.use_fake_user = True
+        # only the pixels of the copy are needed from now on
+        original.buffers_free()
+        self.images[key] = image
+        return image
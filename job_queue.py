@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import time
+
+
+class JobQueue():
+    """Pull-based work queue shared by the dispatcher and its Blender workers.
+
+    The queue lives in a SQLite file next to the job configuration. Workers claim the next
+    pending model when they finish the previous one, so slow meshes do not hold back the
+    models queued behind them.
+    """
+
+    def __init__(self, db_path, timeout=60.0):
+        self.db_path = os.path.abspath(db_path)
+        # autocommit mode, transactions are opened explicitly
+        self.conn = sqlite3.connect(self.db_path, timeout=timeout, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                 id INTEGER PRIMARY KEY,
+                                 path TEXT UNIQUE NOT NULL,
+                                 instance TEXT,
+                                 status TEXT NOT NULL DEFAULT 'pending',
+                                 worker INTEGER,
+                                 attempts INTEGER NOT NULL DEFAULT 0,
+                                 started REAL,
+                                 finished REAL,
+                                 error TEXT)''')
+
+    @classmethod
+    def create(cls, db_path, files, instances=None):
+        """Creates a fresh queue containing the given files, replacing an existing one."""
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        queue = cls(db_path)
+        queue.add(files, instances)
+        return queue
+
+    def add(self, files, instances=None):
+        """Queues the files, the instance names default to the file names without extension."""
+        if instances is None:
+            instances = [os.path.splitext(os.path.basename(f))[0] for f in files]
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany('INSERT OR IGNORE INTO jobs (path, instance) VALUES (?, ?)', zip(files, instances))
+        self.conn.execute('COMMIT')
+
+    def claim(self, worker_id):
+        """Atomically takes the next pending (file, instance) for the worker, returns None once the queue is drained."""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute("SELECT id, path, instance FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                self.conn.execute('COMMIT')
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, started = ? "
+                              "WHERE id = ?", (worker_id, time.time(), row[0]))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return row[1], row[2]
+
+    def done(self, path):
+        self.conn.execute("UPDATE jobs SET status = 'done', finished = ?, error = NULL WHERE path = ?",
+                          (time.time(), path))
+
+    def fail(self, path, error):
+        self.conn.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE path = ?",
+                          (time.time(), str(error), path))
+
+    def running(self):
+        """Returns (path, instance, worker, started) of the jobs currently being rendered."""
+        return self.conn.execute("SELECT path, instance, worker, started FROM jobs WHERE status = 'running'").fetchall()
+
+    def fail_worker(self, worker_id, error):
+        """Marks the job of a worker that died or was killed as failed."""
+        self.conn.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE status = 'running' AND worker = ?",
+                          (time.time(), str(error), worker_id))
+
+    def retry_failed(self, max_attempts):
+        """Queues failed jobs again, jobs that failed max_attempts times are quarantined instead."""
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.execute("UPDATE jobs SET status = 'quarantined' WHERE status = 'failed' AND attempts >= ?", (max_attempts,))
+        self.conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'failed'")
+        self.conn.execute('COMMIT')
+
+    def throughput(self):
+        """Finished instances per second between the first claim and the last finished instance, ignoring startup."""
+        done, first, last = self.conn.execute("SELECT COUNT(*), MIN(started), MAX(finished) FROM jobs "
+                                              "WHERE status = 'done'").fetchone()
+        return done / (last - first) if done and last > first else 0.0
+
+    def quarantined(self):
+        """Returns (path, instance, attempts, error) of the quarantined jobs."""
+        return self.conn.execute("SELECT path, instance, attempts, error FROM jobs WHERE status = 'quarantined' "
+                                 "ORDER BY id").fetchall()
+
+    def counts(self):
+        """Returns the number of jobs per status."""
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def close(self):
+        self.conn.close()
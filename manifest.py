@@ -0,0 +1,75 @@
+import os
+import json
+import hashlib
+
+MANIFEST_FILE = 'manifest.json'
+# Config entries that do not change what is rendered
+# dotted paths of keys that do not change the rendered output
+IGNORED_KEYS = ['file_path', 'out_dir', 'mesh_cache',
+                'output.writer_threads', 'output.max_pending', 'output.staging_dir']
+
+
+def strip_keys(config, prefix=''):
+    return {k: strip_keys(v, f'{prefix}{k}.') if isinstance(v, dict) else v
+            for k, v in config.items() if f'{prefix}{k}' not in IGNORED_KEYS}
+
+
+def config_hash(config):
+    """Hashes the parts of the config that influence the rendered output."""
+    relevant = strip_keys(config)
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def instance_dir(config, instance_name):
+    return os.path.join(config['out_dir'], instance_name)
+
+
+def write_manifest(obj_dir, config, num_views, files, shard=None):
+    """Records a finished instance, the files are stored relative to the instance directory with their sizes.
+
+    If the outputs were packed into a shard, the shard returned by ShardWriter.add_instance is recorded instead.
+    """
+    manifest = {
+        'config_hash': config_hash(config),
+        'num_views': num_views,
+    }
+    if shard is None:
+        manifest['files'] = {os.path.relpath(f, obj_dir): os.path.getsize(f) for f in files}
+    else:
+        manifest['files'] = shard['files']
+        manifest['shard'] = {'path': os.path.relpath(shard['path'], obj_dir), 'end': shard['end']}
+    # write to a temporary file first so that a crash never leaves a truncated manifest
+    tmp_path = os.path.join(obj_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, os.path.join(obj_dir, MANIFEST_FILE))
+
+
+def read_manifest(obj_dir):
+    try:
+        with open(os.path.join(obj_dir, MANIFEST_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_manifest(obj_dir):
+    path = os.path.join(obj_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def is_complete(obj_dir, config):
+    """Checks whether an instance was fully rendered with the given config and all of its outputs are intact."""
+    manifest = read_manifest(obj_dir)
+    if manifest is None or manifest['config_hash'] != config_hash(config) or manifest['num_views'] == 0:
+        return False
+    if 'shard' in manifest:
+        # the shard has to contain everything up to the end of the instance
+        path = os.path.join(obj_dir, manifest['shard']['path'])
+        return os.path.isfile(path) and os.path.getsize(path) >= manifest['shard']['end']
+    for f, size in manifest['files'].items():
+        path = os.path.join(obj_dir, f)
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            return False
+    return True
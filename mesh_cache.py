@@ -0,0 +1,101 @@
+import os
+import json
+import uuid
+import hashlib
+
+import bpy
+
+# Bump whenever the preprocessing in BlenderInterface.import_mesh changes
+CACHE_VERSION = 1
+# Stores after which the cache is walked again even below the size limit, other workers grow it too
+RESCAN_INTERVAL = 100
+# Eviction frees space down to this fraction of the limit, so a full cache is not walked on every store
+LOW_WATERMARK = 0.9
+
+
+class MeshCache():
+    """Stores imported and preprocessed meshes as .blend libraries.
+
+    Entries are keyed by the content of the source file and the object settings, so re-rendering a model with
+    another lighting or camera config loads the prepared object instead of running the importer again. The least
+    recently used entries are evicted once the cache grows beyond max_bytes. The size is tracked per store, the cache
+    directory is only walked when the estimate exceeds the limit or every RESCAN_INTERVAL stores.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        # estimated size of all entries, None until the cache was walked
+        self.total_bytes = None
+        self.stores = 0
+
+    def key(self, fpath, object_config):
+        h = hashlib.sha256(f'{CACHE_VERSION}:{os.path.splitext(fpath)[-1].lower()}'.encode('utf-8'))
+        with open(fpath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        h.update(json.dumps(object_config, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.blend')
+
+    def load(self, key):
+        """Appends the cached object to the scene, returns None on a cache miss."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+            data_to.objects = list(data_from.objects)
+        obj = data_to.objects[0]
+        bpy.context.scene.collection.objects.link(obj)
+        bpy.context.view_layer.update()
+        # mark as recently used for the eviction
+        os.utime(path)
+        return obj
+
+    def store(self, key, obj):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the object is written together with its mesh, materials & images, workers storing the same key at the
+        # same time each write their own temporary file
+        tmp_path = f'{path[:-len(".blend")]}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp.blend'
+        bpy.data.libraries.write(tmp_path, {obj}, path_remap='ABSOLUTE', fake_user=False, compress=False)
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        self.stores += 1
+        if self.total_bytes is None or self.stores % RESCAN_INTERVAL == 0:
+            self.evict()
+        else:
+            self.total_bytes += size - replaced
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for f in files:
+                if f.endswith('.blend') and not f.endswith('.tmp.blend'):
+                    try:
+                        st = os.stat(os.path.join(root, f))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, os.path.join(root, f)))
+        total = sum(e[1] for e in entries)
+        if total <= self.max_bytes:
+            self.total_bytes = total
+            return
+        # least recently used first
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes * LOW_WATERMARK:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # evicted by another worker
+                pass
+            total -= size
+        self.total_bytes = total
@@ -0,0 +1,100 @@
+import os
+import zlib
+import itertools
+import shutil
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def png_chunks(data):
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        yield kind, data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+
+def png_chunk(kind, payload):
+    return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+
+
+def recompress_png(src, dst, level):
+    """Deflates the image data of a PNG written without compression, the filtered scanlines stay untouched."""
+    with open(src, 'rb') as f:
+        data = f.read()
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError(f'{src} is not a PNG file')
+    chunks = list(png_chunks(data))
+    idat = zlib.compress(zlib.decompress(b''.join(p for k, p in chunks if k == b'IDAT')), level)
+    out = [PNG_SIGNATURE]
+    for kind, payload in chunks:
+        if kind == b'IDAT':
+            # all image data goes into the first IDAT chunk
+            if idat is not None:
+                out.append(png_chunk(b'IDAT', idat))
+                idat = None
+        else:
+            out.append(png_chunk(kind, payload))
+    with open(dst, 'wb') as f:
+        f.write(b''.join(out))
+
+
+class OutputWriter():
+    """Writes the outputs of the render loop on a pool of background threads.
+
+    Blender saves every render to a local staging directory, PNGs without compression. The threads deflate the PNGs
+    (zlib releases the GIL) and move all files to the output directory while the next view renders. At most
+    max_pending files are in flight, submitting more blocks the render loop until storage catches up. flush() waits
+    for all outputs of an instance and raises the first error.
+    """
+
+    def __init__(self, num_threads=4, max_pending=64, staging_dir='', png_compression=15):
+        self.staging_dir = tempfile.mkdtemp(prefix='shapenet_renderer_', dir=staging_dir or None)
+        self.png_level = round(png_compression / 100 * 9)
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+        self.counter = itertools.count()
+
+    def staging_path(self, path):
+        """Where Blender saves a file before it is moved to path."""
+        return os.path.join(self.staging_dir, f'{next(self.counter)}_{os.path.basename(path)}')
+
+    def submit(self, fn, *args):
+        # backpressure: wait until one of the pending outputs is written
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+    def move(self, staged, path):
+        if staged.endswith('.png') and self.png_level > 0:
+            recompress_png(staged, path, self.png_level)
+            os.remove(staged)
+        else:
+            shutil.move(staged, path)
+
+    def submit_file(self, staged, path):
+        self.submit(self.move, staged, path)
+
+    def flush(self):
+        futures, self.futures = self.futures, []
+        errors = [f.exception() for f in futures]
+        errors = [e for e in errors if e is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
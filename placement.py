@@ -0,0 +1,79 @@
+import os
+import glob
+import shutil
+
+
+def parse_cpulist(text):
+    """Parses a kernel cpulist like 0-3,8-11 into a list of CPU ids."""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus += list(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def available_cpus():
+    """CPUs this process may run on, e.g. restricted by a batch scheduler."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes():
+    """Available CPUs per NUMA node, a single node where the topology is unknown."""
+    cpus = set(available_cpus())
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'),
+                       key=lambda p: int(os.path.basename(os.path.dirname(p))[4:])):
+        with open(path, 'r') as f:
+            node_cpus = [c for c in parse_cpulist(f.read()) if c in cpus]
+        if node_cpus:
+            nodes.append((int(os.path.basename(os.path.dirname(path))[4:]), node_cpus))
+    return nodes or [(None, sorted(cpus))]
+
+
+def plan(num_jobs, threads=0, pin='cores'):
+    """Assigns a thread count & CPUs to every worker.
+
+    Without an explicit thread count the available CPUs are split evenly between the workers. With pin='cores' each
+    worker gets its own contiguous range of CPUs, 'numa' additionally keeps every worker within one NUMA node, workers
+    are spread round-robin over the nodes. Returns one dict per worker with threads, cpus (None if not pinned) & node.
+    """
+    cpus = available_cpus()
+    threads = threads or max(1, len(cpus) // num_jobs)
+    if pin == 'none' or not hasattr(os, 'sched_setaffinity'):
+        return [{'threads': threads, 'cpus': None, 'node': None} for _ in range(num_jobs)]
+
+    nodes = numa_nodes() if pin == 'numa' else [(None, cpus)]
+    placements = []
+    offsets = [0] * len(nodes)
+    for job in range(num_jobs):
+        n = job % len(nodes)
+        node, node_cpus = nodes[n]
+        # wrap around if the workers need more CPUs than the node has, they share CPUs then
+        worker_cpus = [node_cpus[(offsets[n] + i) % len(node_cpus)] for i in range(min(threads, len(node_cpus)))]
+        offsets[n] += threads
+        placements.append({'threads': threads, 'cpus': worker_cpus, 'node': node})
+    return placements
+
+
+def command_prefix(placement):
+    """Binds the memory of a worker to its NUMA node with numactl, if installed."""
+    if placement['node'] is None or shutil.which('numactl') is None:
+        return []
+    return ['numactl', f'--membind={placement["node"]}']
+
+
+def candidate_splits(num_cpus, max_jobs=None):
+    """jobs x threads splits that use all CPUs, for the auto-tuning."""
+    splits = []
+    jobs = 1
+    while jobs <= min(num_cpus, max_jobs or num_cpus):
+        splits.append((jobs, max(1, num_cpus // jobs)))
+        jobs *= 2
+    return splits
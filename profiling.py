@@ -0,0 +1,129 @@
+import os
+import sys
+import json
+import glob
+import time
+import socket
+import argparse
+import statistics
+from contextlib import contextmanager
+
+PROFILING_DIR = 'profiling'
+
+
+class Profiler():
+    """Collects the wall time per pipeline stage and some statistics of the instance currently rendered.
+
+    One JSON record per instance is appended to a JSONL file per worker in out_dir/profiling.
+    """
+
+    def __init__(self):
+        self.record = None
+        self.reset()
+
+    def reset(self):
+        self.record = {'stages': {}, 'calls': {}}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record['stages'][name] = self.record['stages'].get(name, 0.0) + time.perf_counter() - start
+            self.record['calls'][name] = self.record['calls'].get(name, 0) + 1
+
+    def set(self, **kwargs):
+        self.record.update(kwargs)
+
+    def add(self, **kwargs):
+        """Sums up values over several calls, e.g. the views of all variants of an instance."""
+        for k, v in kwargs.items():
+            self.record[k] = self.record.get(k, 0) + v
+
+    def write(self, out_dir, memory_usage=None):
+        """Appends the record of the current instance and starts a new one."""
+        self.record['time'] = time.time()
+        self.record['total'] = sum(self.record['stages'].values())
+        if memory_usage is not None:
+            self.record.update(memory_usage)
+        path = os.path.join(out_dir, PROFILING_DIR, f'{socket.gethostname()}-{os.getpid()}.jsonl')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(self.record) + '\n')
+        self.reset()
+
+
+def load_records(out_dir):
+    records = []
+    for path in glob.glob(os.path.join(out_dir, '**', PROFILING_DIR, '*.jsonl'), recursive=True):
+        with open(path, 'r') as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    return records
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize(records, outlier_threshold=3.0):
+    """Aggregates the records per stage and flags instances that take much longer than the typical one."""
+    stages = {}
+    for r in records:
+        for name, seconds in r['stages'].items():
+            stages.setdefault(name, []).append(seconds)
+    summary = {'instances': len(records), 'stages': {}}
+    for name, values in stages.items():
+        summary['stages'][name] = {
+            'total': sum(values),
+            'mean': statistics.mean(values),
+            'median': statistics.median(values),
+            'p95': percentile(values, 0.95),
+            'max': max(values),
+        }
+
+    # robust outlier detection on the total time with the median absolute deviation
+    totals = [r['total'] for r in records]
+    summary['outliers'] = []
+    if totals:
+        median = statistics.median(totals)
+        mad = statistics.median([abs(t - median) for t in totals]) * 1.4826
+        limit = median + outlier_threshold * max(mad, 0.05 * median)
+        summary['outliers'] = sorted([{k: r.get(k) for k in ['instance', 'total', 'vertices', 'faces', 'output_bytes']}
+                                      for r in records if r['total'] > limit], key=lambda r: -r['total'])
+    return summary
+
+
+def print_summary(summary):
+    print(f'{summary["instances"]} instances')
+    print(f'{"stage":<12} {"total [s]":>10} {"mean [s]":>10} {"median [s]":>10} {"p95 [s]":>10} {"max [s]":>10}')
+    for name, s in sorted(summary['stages'].items(), key=lambda kv: -kv[1]['total']):
+        print(f'{name:<12} {s["total"]:>10.2f} {s["mean"]:>10.3f} {s["median"]:>10.3f} {s["p95"]:>10.3f} {s["max"]:>10.3f}')
+    if summary['outliers']:
+        print('Outliers:')
+        for r in summary['outliers']:
+            print(f'  {r["instance"]}: {r["total"]:.2f}s, {r["vertices"]} vertices, {r["faces"]} faces')
+
+
+def main():
+    p = argparse.ArgumentParser(description='Summarizes the per-stage timings written by the renderer.')
+    p.add_argument('out_dir', type=str, help='Output directory of the renderer.')
+    p.add_argument('--outlier_threshold', type=float, default=3.0,
+                   help='Flag instances slower than median + threshold * MAD of the total time.')
+    p.add_argument('--json', action='store_true', help='Print the summary as JSON.')
+    opt = p.parse_args()
+
+    records = load_records(opt.out_dir)
+    if not records:
+        print(f'No profiling records found in {opt.out_dir}')
+        sys.exit(1)
+    summary = summarize(records, opt.outlier_threshold)
+    if opt.json:
+        print(json.dumps(summary, indent=4))
+    else:
+        print_summary(summary)
+
+
+if __name__ == '__main__':
+    main()
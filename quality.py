@@ -0,0 +1,97 @@
+import math
+
+# Named EEVEE quality profiles. Shadow maps & ray tracing are sized relative to the output resolution:
+# shadow_texels_per_pixel sets the shadow map (cascade) size per rendered pixel and ray tracing runs at about
+# raytrace_pixels pixels along the longer image side (None traces at full resolution).
+PROFILES = {
+    'preview': {
+        'samples': 1,
+        'shadow_texels_per_pixel': 1,
+        'soft_shadows': False,
+        'cascade_count': 1,
+        'shadow_rays': 1,
+        'shadow_steps': 1,
+        'raytrace_pixels': 128,
+        'denoise': False,
+        'fast_gi': False,
+        'ao': False,
+        'gtao_quality': 0.1,
+    },
+    'dataset': {
+        'samples': 16,
+        'shadow_texels_per_pixel': 4,
+        'soft_shadows': True,
+        'cascade_count': 2,
+        'shadow_rays': 1,
+        'shadow_steps': 6,
+        'raytrace_pixels': 256,
+        'denoise': True,
+        'fast_gi': True,
+        'ao': True,
+        'gtao_quality': 0.25,
+    },
+    'hero': {
+        'samples': 64,
+        'shadow_texels_per_pixel': 8,
+        'soft_shadows': True,
+        'cascade_count': 4,
+        'shadow_rays': 2,
+        'shadow_steps': 16,
+        'raytrace_pixels': None,
+        'denoise': True,
+        'fast_gi': True,
+        'ao': True,
+        'gtao_quality': 0.5,
+    },
+}
+
+# Sizes accepted by the legacy EEVEE shadow_cascade_size & the EEVEE Next resolution scale enums
+CASCADE_SIZES = [64, 128, 256, 512, 1024, 2048, 4096]
+RAYTRACE_SCALES = [1, 2, 4, 8, 16]
+
+
+def cascade_size(max_dim, texels_per_pixel):
+    size = 2 ** math.ceil(math.log2(max_dim * texels_per_pixel))
+    return str(min(max(size, CASCADE_SIZES[0]), CASCADE_SIZES[-1]))
+
+
+def raytrace_scale(max_dim, raytrace_pixels):
+    if raytrace_pixels is None:
+        return '1'
+    scale = 2 ** math.floor(math.log2(max(max_dim / raytrace_pixels, 1)))
+    return str(min(scale, RAYTRACE_SCALES[-1]))
+
+
+def resolve(config):
+    """Returns the EEVEE settings for the quality profile in config['rendering']['quality'].
+
+    The 'custom' profile (the default) uses the shadow & AO settings of the config as they are and leaves the sample
+    count at Blender's default, which is marked with None.
+    """
+    rendering = config['rendering']
+    name = rendering.get('quality', 'custom')
+    if name == 'custom':
+        return {
+            'samples': None,
+            'shadow_size': rendering['shadow']['cascade_size'],
+            'soft_shadows': rendering['shadow']['use_soft_shadows'],
+            'cascade_count': config['lighting']['sun_light']['cascade_count'],
+            'shadow_rays': None,
+            'shadow_steps': None,
+            'raytrace_scale': '1',
+            'denoise': True,
+            'fast_gi': True,
+            'ao': rendering['ao']['enable'],
+            'gtao_quality': None,
+        }
+    if name not in PROFILES:
+        raise ValueError(f'Unknown quality profile {name}, use one of {["custom"] + list(PROFILES.keys())}')
+
+    profile = PROFILES[name]
+    max_dim = max(rendering['camera']['width'], rendering['camera']['height'])
+    settings = {k: v for k, v in profile.items() if k not in ['shadow_texels_per_pixel', 'raytrace_pixels']}
+    settings['shadow_size'] = cascade_size(max_dim, profile['shadow_texels_per_pixel'])
+    settings['raytrace_scale'] = raytrace_scale(max_dim, profile['raytrace_pixels'])
+    # a profile can only turn AO off, not on
+    settings['ao'] = profile['ao'] and rendering['ao']['enable']
+    return settings
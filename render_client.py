@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+from multiprocessing.connection import Client
+
+
+def default_address():
+    if sys.platform == 'win32':
+        return r'\\.\pipe\shapenet_renderer'
+    return os.path.join(tempfile.gettempdir(), 'shapenet_renderer.sock')
+
+
+def submit(job, address=None, authkey=None):
+    """Sends a job to a running render server and waits for its result."""
+    with Client(address or default_address(), authkey=authkey) as conn:
+        conn.send(job)
+        return conn.recv()
+
+
+def main():
+    p = argparse.ArgumentParser(description='Sends render jobs to a running render_server.py.')
+    p.add_argument('--mesh_fpath', type=str, help='File path to the 3D model to render.')
+    p.add_argument('--config', type=str, default=None, help='Optional JSON file with config overrides for this job.')
+    p.add_argument('--instance_name', type=str, default=None, help='Name of the output folder, defaults to the file name.')
+    p.add_argument('--address', type=str, default=default_address(), help='Address the render server listens on.')
+    p.add_argument('--authkey', type=str, default=None, help='Shared secret of the render server.')
+    p.add_argument('--shutdown', action='store_true', help='Stop the render server.')
+    opt = p.parse_args()
+
+    if opt.shutdown:
+        job = {'command': 'shutdown'}
+    else:
+        if opt.mesh_fpath is None:
+            p.error('--mesh_fpath is required unless --shutdown is given')
+        job = {'mesh_fpath': os.path.abspath(opt.mesh_fpath)}
+        if opt.config is not None:
+            with open(opt.config, 'r') as f:
+                job['config'] = json.load(f)
+        if opt.instance_name is not None:
+            job['instance_name'] = opt.instance_name
+
+    result = submit(job, opt.address, opt.authkey.encode() if opt.authkey else None)
+    print(json.dumps(result, indent=4))
+    if result['status'] != 'ok':
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
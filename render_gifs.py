@@ -1,6 +1,64 @@
 import os
+import math
+import tempfile
 import subprocess
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+
+def find_frame_dirs(input_dir):
+    """Collects all rgb folders below the input directory, instances may be nested (e.g. synset/model_id)."""
+    frame_dirs = []
+    for root, dirs, files in os.walk(input_dir):
+        if os.path.basename(root) == 'rgb':
+            frame_dirs.append(root)
+            dirs[:] = []
+    return sorted(frame_dirs)
+
+
+def is_up_to_date(output_gif_path, frames):
+    """A GIF only has to be regenerated if one of its frames is newer."""
+    if not os.path.exists(output_gif_path):
+        return False
+    gif_mtime = os.path.getmtime(output_gif_path)
+    return all(os.path.getmtime(f) <= gif_mtime for f in frames)
+
+
+def make_gif(subfolder_path, frames, opt):
+    output_gif_path = os.path.join(subfolder_path, "output.gif")
+    frame_pattern = os.path.join(subfolder_path, f"%06d_{opt.camera}.png")
+    ffmpeg = ["ffmpeg", "-y", "-loglevel", "error", "-framerate", f"{opt.fps}", "-i", frame_pattern]
+    scale = f"scale={opt.resolution}:{opt.resolution}:flags=lanczos"
+
+    if not opt.palette:
+        subprocess.run(ffmpeg + ["-s", f"{opt.resolution}:{opt.resolution}", "-loop", "0", output_gif_path],
+                       check=True)
+        return output_gif_path
+
+    # two passes: build the palette once from a subsampled set of frames, then map all frames to it
+    step = max(1, math.ceil(len(frames) / opt.palette_frames))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        palette_path = os.path.join(tmp_dir, "palette.png")
+        subprocess.run(ffmpeg + ["-vf", f"select=not(mod(n\\,{step})),{scale},palettegen=stats_mode=full",
+                                 "-frames:v", "1", palette_path], check=True)
+        subprocess.run(ffmpeg + ["-i", palette_path, "-lavfi", f"{scale}[x];[x][1:v]paletteuse=dither=sierra2_4a",
+                                 "-loop", "0", output_gif_path], check=True)
+    return output_gif_path
+
+
+def process_subfolder(subfolder_path, opt):
+    frames = [os.path.join(subfolder_path, f) for f in os.listdir(subfolder_path) if f.endswith(f"_{opt.camera}.png")]
+    if not frames:
+        return f"No frames found in {subfolder_path}"
+    if not opt.force and is_up_to_date(os.path.join(subfolder_path, "output.gif"), frames):
+        return f"Up to date: {subfolder_path}"
+    try:
+        return f"Generated GIF: {make_gif(subfolder_path, frames, opt)}"
+    except subprocess.CalledProcessError as e:
+        return f"Error processing subfolder {subfolder_path}: {e}"
+    except Exception as e:
+        return f"Unexpected error: {e}"
+
 
 def main():
     # Parse command-line arguments
@@ -8,44 +66,25 @@ def main():
     parser.add_argument("--resolution", type=str, required=True, help="Resolution (e.g., 320 for width)")
     parser.add_argument("--fps", type=int, required=True, help="Frames per second")
     parser.add_argument("--input_dir", type=str, required=True, help="Input directory containing subfolders with image sequences")
-    args = parser.parse_args()
-
-    resolution = args.resolution
-    fps = args.fps
-    input_dir = args.input_dir
+    parser.add_argument("--camera", type=int, default=0, help="Index of the rig camera to animate (default: 0)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of concurrent ffmpeg processes")
+    parser.add_argument("--palette", action="store_true", help="Use a generated palette for higher quality GIFs")
+    parser.add_argument("--palette_frames", type=int, default=16, help="Maximum number of frames the palette is built from")
+    parser.add_argument("--force", action="store_true", help="Regenerate GIFs even if they are newer than their frames")
+    opt = parser.parse_args()
 
     # Validate input directory
-    if not os.path.isdir(input_dir):
-        print(f"Error: {input_dir} is not a valid directory.")
+    if not os.path.isdir(opt.input_dir):
+        print(f"Error: {opt.input_dir} is not a valid directory.")
         return
 
-    # Process each subfolder in the input directory
-    for subfolder in os.listdir(input_dir):
-        subfolder_path = os.path.join(os.path.join(input_dir, subfolder), 'rgb')
-
-        if os.path.isdir(subfolder_path):
-            output_gif_path = os.path.join(subfolder_path, "output.gif")
-
-            # Run FFMPEG command
-            ffmpeg_command = [
-                "ffmpeg",
-                "-framerate", f"{fps}",
-                "-i", os.path.join(subfolder_path, "%06d.png"),
-                # "-vf", f"fps={fps},scale={resolution}:-1:flags=lanczos,split[s0][s1];[s0]palettegen[p];[s1][p]paletteuse",
-                "-s", f"{resolution}:{resolution}",
-                "-loop", "0",
-                output_gif_path
-            ]
-
-            print(f"Processing subfolder: {subfolder_path}")
-            try:
-                subprocess.run(ffmpeg_command, check=True)
-                print(f"Generated GIF: {output_gif_path}")
-            except subprocess.CalledProcessError as e:
-                print(f"Error processing subfolder {subfolder_path}: {e}")
-            except Exception as e:
-                print(f"Unexpected error: {e}")
+    # Process the subfolders in parallel, every job runs its own ffmpeg process
+    frame_dirs = find_frame_dirs(opt.input_dir)
+    print(f"Processing {len(frame_dirs)} subfolders with {opt.jobs} jobs")
+    with ThreadPoolExecutor(max_workers=opt.jobs) as executor:
+        for message in executor.map(lambda d: process_subfolder(d, opt), frame_dirs):
+            print(message)
+
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import argparse
+import traceback
+from multiprocessing.connection import Listener
+
+sys.path.append(os.path.dirname(__file__))
+
+import util
+import variants
+import blender_interface
+from render_client import default_address
+
+# Config entries that are read per object and can therefore change between jobs. Everything else
+# (camera, lighting, world) is set up once when the server starts.
+RELOADABLE_KEYS = ['out_dir', 'num_observations', 'mode', 'view_planning', 'object', 'rendering.use_exr',
+                   'rendering.exr', 'rendering.output_formats', 'rendering.fog', 'variants', 'sweep']
+
+
+def flatten_keys(config, prefix=''):
+    keys = []
+    for k, v in config.items():
+        key = prefix + k
+        if isinstance(v, dict) and key not in RELOADABLE_KEYS:
+            keys.extend(flatten_keys(v, key + '.'))
+        else:
+            keys.append(key)
+    return keys
+
+
+def check_overrides(overrides):
+    fixed = [k for k in flatten_keys(overrides)
+             if not any(k == r or k.startswith(r + '.') for r in RELOADABLE_KEYS)]
+    if fixed:
+        raise ValueError(f'Overrides {fixed} require restarting the render server, only {RELOADABLE_KEYS} can change per job')
+
+
+def handle_job(renderer, base_config, job):
+    """Renders a single mesh, the job holds the mesh path and optional config overrides."""
+    overrides = job.get('config', {})
+    check_overrides(overrides)
+    config = variants.merge_config(base_config, overrides)
+
+    mesh_fpath = job['mesh_fpath']
+    if not util.is_allowed_type(mesh_fpath):
+        raise ValueError(f'Unsupported file type {mesh_fpath}')
+    instance_name = job.get('instance_name', os.path.splitext(os.path.basename(mesh_fpath))[0])
+
+    # the object is removed by render_instance, also if the job failed
+    rendered = renderer.render_instance(mesh_fpath, instance_name, [c for _, c in variants.expand_variants(config)])
+    return {'instance_name': instance_name, 'out_dir': os.path.join(config['out_dir'], instance_name),
+            'rendered': rendered}
+
+
+def serve(address, config, authkey=None):
+    renderer = blender_interface.BlenderInterface(config)
+    # remove the socket left behind by a server that was killed
+    if sys.platform != 'win32' and os.path.exists(address):
+        os.remove(address)
+    with Listener(address, authkey=authkey) as listener:
+        print(f'Render server listening on {listener.address}')
+        while True:
+            with listener.accept() as conn:
+                job = conn.recv()
+                if job.get('command') == 'shutdown':
+                    conn.send({'status': 'ok'})
+                    break
+                start = time.time()
+                try:
+                    result = handle_job(renderer, config, job)
+                    result.update({'status': 'ok', 'seconds': time.time() - start})
+                except Exception as e:
+                    traceback.print_exc()
+                    result = {'status': 'error', 'error': str(e), 'traceback': traceback.format_exc()}
+                conn.send(result)
+    renderer.close()
+
+
+def main():
+    p = argparse.ArgumentParser(description='Keeps Blender and the scene set-up alive and renders meshes sent by render_client.py.')
+    p.add_argument('--config', type=str, required=True, help='Path to JSON config file for dataset.')
+    p.add_argument('--address', type=str, default=default_address(),
+                   help='UNIX socket path, or named pipe on Windows, to listen on.')
+    p.add_argument('--authkey', type=str, default=None, help='Optional shared secret clients have to present.')
+
+    argv = sys.argv[sys.argv.index("--") + 1:]
+    opt = p.parse_args(argv)
+
+    config = util.load_config(opt.config)
+    serve(opt.address, config, authkey=opt.authkey.encode() if opt.authkey else None)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@ import argparse
 sys.path.append(os.path.dirname(__file__))
 
 import util
+import discovery
+import variants
 import blender_interface
 
 
@@ -17,37 +19,27 @@ def main():
 
     opt = p.parse_args(argv)
 
-    instances = []
-    fp = opt.mesh_fpath
-
-    # if it's a directory, collect all the files
+    # if it's a directory, collect all the files below it
     if os.path.isdir(opt.mesh_fpath):
-        instances = [fp for fp in os.listdir(opt.mesh_fpath) if util.is_allowed_type(fp)]
+        instances = [(m['path'], m['id']) for m in discovery.discover(opt.mesh_fpath)]
+    elif util.is_allowed_type(opt.mesh_fpath):
+        instances = [(opt.mesh_fpath, os.path.splitext(os.path.basename(opt.mesh_fpath))[0])]
     else:
-        if util.is_allowed_type(opt.mesh_fpath):
-            instances.append(opt.mesh_fpath)
-            fp = os.path.dirname(opt.mesh_fpath)
+        instances = []
     if len(instances) == 0:
         raise ValueError('Input must either be a directory containing 3D model files or a path to a single 3D model file.')
 
-    # load the config & instantiate renderer
+    # load the config & instantiate renderer, every mesh is imported once and rendered for all config variants
     config = util.load_config(opt.config)
-    renderer = blender_interface.BlenderInterface(config)
-
-    for instance in instances:
-        print(instance, fp)
-        # import instance
-        renderer.import_mesh(os.path.join(fp, instance))
-        instance_name = os.path.splitext(os.path.basename(instance))[0]
-        # sample locations for camera
-        radius = renderer.fit_to_view()
-        num_observations = config['num_observations']
-        if config['mode'] == 'train':
-            positions = util.sample_spherical(radius, num_observations)
-        elif config['mode'] == 'test':
-            positions = util.sample_archimedean_spiral(radius, num_observations)
-
-        renderer.render(instance_name, positions, write_cam_params=True)
+    configs = [c for _, c in variants.expand_variants(config)]
+    renderer = blender_interface.BlenderInterface(configs[0])
+
+    for instance, instance_name in instances:
+        print(instance, instance_name)
+        # variants that were already rendered with the same config are skipped
+        renderer.render_instance(instance, instance_name, configs)
+
+    renderer.close()
 
 
 if __name__ == '__main__':
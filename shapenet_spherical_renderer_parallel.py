@@ -3,16 +3,19 @@ import argparse
 import os
 import sys
 import json
+import traceback
 
 sys.path.append(os.path.dirname(__file__))
 
 import util
+import variants
 import blender_interface
+from job_queue import JobQueue
 
 
 def main():
     p = argparse.ArgumentParser(description='Batched rendering of spherical views of given 3D models in *.obj, *.ply or *.gltf format by rotating a camera around it.')
-    p.add_argument('--batch_file', type=str, required=True, help='Path to JSON file containing files to process.')
+    p.add_argument('--batch_file', type=str, required=True, help='Path to JSON file pointing to the job queue.')
     p.add_argument('--batch_id', type=int, required=True, help='ID to identify the current batch job.')
     p.add_argument('--config', type=str, required=True, help='Path to JSON config file for dataset.')
 
@@ -28,30 +31,35 @@ def main():
     # root path for batch files
     fp = batch['root_path']
 
-    # collect all the files to process
-    print(batch['files'][opt.batch_id])
-    instances = [f for f in batch['files'][opt.batch_id] if util.is_allowed_type(f)]
-    if len(instances) == 0:
-        raise ValueError('Input must either be a directory containing 3D model files or a path to a single 3D model file.')
+    # the queue hands out the next file whenever this worker is idle
+    queue = JobQueue(batch['queue'])
 
     # load the config & instantiate renderer
     config = util.load_config(opt.config)
-    renderer = blender_interface.BlenderInterface(config)
+    configs = [c for _, c in variants.expand_variants(config)]
+    renderer = blender_interface.BlenderInterface(configs[0])
 
-    for instance in instances:
+    while True:
+        job = queue.claim(opt.batch_id)
+        if job is None:
+            break
+        instance, instance_name = job
+        if not util.is_allowed_type(instance):
+            queue.fail(instance, 'unsupported file type')
+            continue
         print(instance, fp)
-        # import instance
-        renderer.import_mesh(os.path.join(fp, instance))
-        instance_name = os.path.splitext(os.path.basename(instance))[0]
-        # sample locations for camera
-        radius = renderer.fit_to_view()
-        num_observations = config['num_observations']
-        if config['mode'] == 'train':
-            positions = util.sample_spherical(radius, num_observations)
-        elif config['mode'] == 'test':
-            positions = util.sample_archimedean_spiral(radius, num_observations)
-
-        renderer.render(instance_name, positions, write_cam_params=True)
+        try:
+            # imports the instance once for all variants, complete ones are skipped
+            renderer.render_instance(os.path.join(fp, instance), instance_name, configs)
+        except Exception:
+            traceback.print_exc()
+            queue.fail(instance, traceback.format_exc())
+            continue
+        queue.done(instance)
+
+    renderer.close()
+    print(f'Batch job {opt.batch_id} finished, queue status: {queue.counts()}')
+    queue.close()
 
 
 if __name__ == '__main__':
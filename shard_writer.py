@@ -0,0 +1,68 @@
+import os
+import json
+import uuid
+import tarfile
+
+SHARD_DIR = 'shards'
+INDEX_SUFFIX = '.idx.jsonl'
+
+
+class ShardWriter():
+    """Packs the outputs of rendered instances into sequential tar shards.
+
+    Every shard is accompanied by a JSONL index with one line per file that stores the instance, the
+    member name and the byte offset & size of its data inside the shard, so single views can be read
+    back without scanning the archive. A new shard is started once the current one exceeds the size target.
+    """
+
+    def __init__(self, out_dir, prefix='shard', max_shard_bytes=1 << 30):
+        self.shard_dir = os.path.join(out_dir, SHARD_DIR)
+        os.makedirs(self.shard_dir, exist_ok=True)
+        # unique per writer so that parallel workers never write to the same shard
+        self.prefix = f'{prefix}-{uuid.uuid4().hex[:8]}'
+        self.max_shard_bytes = max_shard_bytes
+        self.num_shards = 0
+        self.tar = None
+        self.shard_path = None
+
+    def _open_shard(self):
+        self.shard_path = os.path.join(self.shard_dir, f'{self.prefix}-{self.num_shards:06d}.tar')
+        self.tar = tarfile.open(self.shard_path, 'w')
+        self.num_shards += 1
+
+    def add_instance(self, instance_name, obj_dir, files):
+        """Appends the files of an instance to the current shard and returns where they were stored."""
+        if self.tar is None:
+            self._open_shard()
+        entries = []
+        for path in files:
+            name = os.path.relpath(path, obj_dir).replace(os.sep, '/')
+            info = self.tar.gettarinfo(path, arcname=f'{instance_name}/{name}')
+            with open(path, 'rb') as f:
+                self.tar.addfile(info, f)
+            # the data ends padded to the next block after the header
+            offset = self.tar.offset - tarfile.BLOCKSIZE * ((info.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE)
+            entries.append({'instance': instance_name, 'name': name, 'offset': offset, 'size': info.size})
+        self.tar.fileobj.flush()
+
+        # the index is only extended once the data is in the shard
+        with open(self.shard_path + INDEX_SUFFIX, 'a') as f:
+            for e in entries:
+                f.write(json.dumps(e) + '\n')
+
+        shard = {'path': self.shard_path, 'end': self.tar.offset, 'files': {e['name']: e['size'] for e in entries}}
+        if self.tar.offset >= self.max_shard_bytes:
+            self.close()
+        return shard
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+
+
+def read_member(shard_path, offset, size):
+    """Random access to a single file inside a shard using the offset & size from its index."""
+    with open(shard_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
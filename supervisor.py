@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+from job_queue import JobQueue
+
+QUARANTINE_SUFFIX = '.quarantine.json'
+
+
+def get_rss_mb(pid):
+    """Resident memory of a process in MB, None where /proc is not available."""
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def quarantine_path(output_json):
+    return os.path.splitext(os.path.abspath(output_json))[0] + QUARANTINE_SUFFIX
+
+
+def load_quarantine(output_json):
+    """Models quarantined by earlier runs as a dict from path to their last error."""
+    try:
+        with open(quarantine_path(output_json), 'r') as f:
+            return {q['path']: q for q in json.load(f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_quarantine(output_json, quarantined):
+    with open(quarantine_path(output_json), 'w') as f:
+        json.dump(list(quarantined.values()), f, indent=4)
+
+
+class Worker():
+    def __init__(self, worker_id, command, log_path, placement=None):
+        self.worker_id = worker_id
+        self.command = command
+        self.log_path = log_path
+        self.placement = placement or {'threads': None, 'cpus': None}
+        self.process = None
+        self.restarts = 0
+
+    def start(self):
+        env = dict(os.environ)
+        if self.placement['threads']:
+            # OpenMP & BLAS thread pools stay within the budget too. TBB reads no environment variable, Blender limits
+            # it to the --threads of the command
+            for name in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+                env[name] = str(self.placement['threads'])
+        cpus = self.placement['cpus']
+        # pin before exec so that every thread Blender starts inherits the affinity
+        preexec_fn = (lambda: os.sched_setaffinity(0, cpus)) if cpus else None
+        with open(self.log_path, 'a') as log:
+            log.write(f'\n==== {time.strftime("%Y-%m-%d %H:%M:%S")} starting {" ".join(self.command)}'
+                      f'{f" on CPUs {cpus}" if cpus else ""}\n')
+            log.flush()
+            self.process = subprocess.Popen(self.command, stdout=log, stderr=subprocess.STDOUT, env=env,
+                                            preexec_fn=preexec_fn)
+        print(f'Started worker {self.worker_id} (pid {self.process.pid}), log: {self.log_path}')
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class Supervisor():
+    """Runs the Blender workers of a batch and keeps them going until the job queue is drained.
+
+    Crashed workers are restarted, workers that exceed the wall-clock limit per instance or the memory limit are killed
+    and restarted. The instance a worker was rendering counts as failed and is queued again, after max_attempts
+    failures it is quarantined. A worker that keeps crashing before it finishes any instance is not restarted again
+    after max_restarts attempts.
+    """
+
+    def __init__(self, queue_path, commands, log_dir, timeout=None, memory_limit_mb=None, max_attempts=2,
+                 max_restarts=10, poll_interval=1.0, placements=None):
+        self.queue = JobQueue(queue_path)
+        os.makedirs(log_dir, exist_ok=True)
+        placements = placements or [None] * len(commands)
+        self.workers = [Worker(i, c, os.path.join(log_dir, f'worker_{i}.log'), p)
+                        for i, (c, p) in enumerate(zip(commands, placements))]
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_attempts = max_attempts
+        self.max_restarts = max_restarts
+        self.poll_interval = poll_interval
+
+    def check_limits(self, worker, running):
+        """Returns why the worker has to be killed, None if it is within its limits."""
+        if self.timeout and worker.worker_id in running:
+            path, started = running[worker.worker_id]
+            if time.time() - started > self.timeout:
+                return f'timeout: rendering {path} took longer than {self.timeout:.0f}s'
+        if self.memory_limit_mb:
+            rss = get_rss_mb(worker.process.pid)
+            if rss is not None and rss > self.memory_limit_mb:
+                return f'memory limit: {rss:.0f} MB exceeds {self.memory_limit_mb:.0f} MB'
+        return None
+
+    def handle_exit(self, worker, error):
+        """Fails the instance of a worker that stopped, restarts it while there is work left."""
+        self.queue.fail_worker(worker.worker_id, error)
+        self.queue.retry_failed(self.max_attempts)
+        counts = self.queue.counts()
+        if counts.get('pending', 0) == 0:
+            worker.process = None
+            return
+        worker.restarts += 1
+        if worker.restarts > self.max_restarts:
+            print(f'Worker {worker.worker_id} failed {worker.restarts} times in a row, not restarting it')
+            worker.process = None
+            return
+        print(f'Restarting worker {worker.worker_id} after {error}')
+        worker.start()
+
+    def run(self):
+        for worker in self.workers:
+            worker.start()
+        last_job = {}
+        while any(w.process is not None for w in self.workers):
+            time.sleep(self.poll_interval)
+            running = {w: (path, started) for path, _, w, started in self.queue.running()}
+            for worker in self.workers:
+                if worker.process is None:
+                    continue
+                # a worker that moved on to the next instance is healthy again
+                if worker.worker_id in running:
+                    path = running[worker.worker_id][0]
+                    if last_job.get(worker.worker_id, path) != path:
+                        worker.restarts = 0
+                    last_job[worker.worker_id] = path
+
+                code = worker.process.poll()
+                if code == 0:
+                    # the queue was drained, unless failed instances were queued again in the meantime
+                    self.queue.retry_failed(self.max_attempts)
+                    if self.queue.counts().get('pending', 0) > 0:
+                        worker.start()
+                    else:
+                        print(f'Worker {worker.worker_id} finished')
+                        worker.process = None
+                elif code is not None:
+                    self.handle_exit(worker, f'worker crashed with exit code {code}, see {worker.log_path}')
+                else:
+                    reason = self.check_limits(worker, running)
+                    if reason is not None:
+                        print(f'Killing worker {worker.worker_id}, {reason}')
+                        worker.kill()
+                        self.handle_exit(worker, reason)
+            # instances that failed inside a worker are retried as well
+            self.queue.retry_failed(self.max_attempts)
+        return self.queue.counts(), self.queue.quarantined()
+
+    def close(self):
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.kill()
+        self.queue.close()
+
+
+def blender_executable():
+    return 'blender.exe' if sys.platform == 'win32' else 'blender'
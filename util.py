@@ -1,4 +1,5 @@
 import os
+import sys
 import bpy
 import json
 import random
@@ -6,18 +7,20 @@ from mathutils import Matrix, Vector
 import numpy as np
 import math
 from functools import reduce
+import view_planning
 
 def normalize(vec):
     return vec / (np.linalg.norm(vec, axis=-1, keepdims=True) + 1e-9)
 
 
 # All the following functions follow the opencv convention for camera coordinates.
-def look_at(cam_location, point):
+# The camera's y-axis points along the given down direction, the default assumes a y-up world.
+def look_at(cam_location, point, down=np.array([0., -1., 0.])):
     # Cam points in positive z direction
     forward = point - cam_location
     forward = normalize(forward)
 
-    tmp = np.array([0., -1., 0.])
+    tmp = down
 
     right = np.cross(tmp, forward)
     right = normalize(right)
@@ -36,6 +39,19 @@ def look_at(cam_location, point):
     return mat
 
 
+# Computes the cam2world matrices of every camera of the rig at all positions in one vectorized pass.
+# The rig looks at the target like the TRACK_TO constraint of the camera root in Blender's z-up world,
+# each camera is shifted by its offset in the rig's Blender coordinates.
+# Returns an array of shape (positions, cameras, 4, 4).
+def get_camera_poses(positions, offsets, target=np.zeros(3)):
+    rig2world = look_at(np.asarray(positions, dtype=np.float64).reshape(-1, 3), target, down=np.array([0., 0., -1.]))
+    # Blender camera axes are the opencv axes with flipped y & z
+    offsets_cv = np.asarray(offsets, dtype=np.float64).reshape(-1, 3) * np.array([1., -1., -1.])
+    cam2world = np.repeat(rig2world[:, None], len(offsets_cv), axis=1)
+    cam2world[:, :, :3, 3] += np.einsum('nij,cj->nci', rig2world[:, :3, :3], offsets_cv)
+    return cam2world
+
+
 def sample_spherical(n, radius=1.):
     xyz = np.random.normal(size=(n,3))
     xyz = normalize(xyz) * radius
@@ -219,28 +235,67 @@ def is_allowed_type(fp):
 
 
 def sample_archimedean_spiral(sphere_radius, num_steps=250):
-    '''
-    https://en.wikipedia.org/wiki/Spiral, section "Spherical spiral". c = a / pi
-    '''
-    a = 40
-    r = sphere_radius
+    return view_planning.archimedean_spiral(num_steps, sphere_radius)
 
-    translations = []
 
-    i = a / 2
-    while i < a:
-        theta = i / a * np.pi
-        x = r * np.sin(theta) * np.cos(-i)
-        y = r * np.sin(-theta + np.pi) * np.sin(-i)
-        z = r * - np.cos(theta)
+def sample_spherical(radius, num_steps=250):
+    return view_planning.random_sphere(num_steps, radius)
 
-        translations.append((x, y, z))
-        i += a / (2 * num_steps)
 
-    return np.array(translations)
+# Sample the camera locations according to the configured mode, seeded per instance if view_planning.seed is set
+def sample_camera_positions(config, radius, instance_name=None):
+    seed = view_planning.instance_seed(config.get('view_planning', {}).get('seed'), instance_name)
+    return view_planning.sample_positions(config['mode'], config['num_observations'], radius, seed)
 
 
-def sample_spherical(radius, num_steps=250):
-    xyz = np.random.normal(size=(num_steps, 3))
-    xyz = normalize(xyz) * radius
-    return xyz
+# All camera poses & the intrinsics of an instance in a single file
+def write_poses(path, cam2world, K, im_h, im_w, crop=None):
+    arrays = {'cam2world': cam2world, 'world2cam': np.linalg.inv(cam2world), 'intrinsics': K,
+              'resolution': np.array([im_h, im_w])}
+    if crop is not None:
+        # pixel window [x_min, y_min, x_max, y_max) of every cropped EXR in the full image
+        arrays['crop'] = crop
+    np.savez(path, **arrays)
+
+
+def write_intrinsics(path, K, im_h, im_w):
+    with open(path, 'w') as intrinsics_file:
+        intrinsics_file.write('%f %f %f 0.\n' % (K[0][0], K[0][2], K[1][2]))
+        intrinsics_file.write('0. 0. 0.\n')
+        intrinsics_file.write('1.\n')
+        intrinsics_file.write('%d %d\n' % (im_h, im_w))
+
+
+# Camera pose of a single view in the legacy format
+def write_pose_txt(path, cam2world):
+    with open(path, 'w') as pose_file:
+        pose_file.write(' '.join(map(str, cam2world.flatten())) + '\n')
+
+
+# Remove all datablocks without users, e.g. the mesh, materials & images of a deleted object
+def purge_orphan_data():
+    if bpy.app.version >= (3, 2, 0):
+        bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+        return
+    for collection in [bpy.data.meshes, bpy.data.materials, bpy.data.textures, bpy.data.images, bpy.data.actions]:
+        for block in list(collection):
+            if block.users == 0:
+                collection.remove(block)
+
+
+# Current & peak resident memory of this process in MB, None where the platform does not provide it
+def get_memory_usage():
+    usage = {'rss_mb': None, 'peak_rss_mb': None}
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            usage['rss_mb'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # reported in bytes on macOS and in kilobytes elsewhere
+        usage['peak_rss_mb'] = peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    except ImportError:
+        pass
+    return usage
@@ -0,0 +1,81 @@
+import os
+import re
+import itertools
+
+# Settings that are fixed for a whole run, a mesh is imported once and rendered with the same rig for all variants
+FIXED_KEYS = ['object', 'rendering.use_mvs', 'rendering.mvs', 'rendering.mvs_multiview']
+
+
+# Recursively merge a dictionary of overrides into a copy of the config
+def merge_config(config, overrides):
+    merged = dict(config)
+    for k, v in overrides.items():
+        if isinstance(v, dict) and isinstance(merged.get(k), dict):
+            merged[k] = merge_config(merged[k], v)
+        else:
+            merged[k] = v
+    return merged
+
+
+def get_key(config, key):
+    for k in key.split('.'):
+        config = config[k]
+    return config
+
+
+def set_key(overrides, key, value):
+    """Sets a dotted key like lighting.sun.energy in a nested dict of overrides."""
+    keys = key.split('.')
+    for k in keys[:-1]:
+        overrides = overrides.setdefault(k, {})
+    overrides[keys[-1]] = value
+
+
+def variant_name(key, value):
+    value = value if isinstance(value, str) else repr(value)
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', f'{key.split(".")[-1]}={value}').strip('_')
+
+
+def expand_sweep(sweep):
+    """Turns {dotted key: [values]} into one variant per combination of the values."""
+    keys = list(sweep.keys())
+    variants = []
+    for values in itertools.product(*[sweep[k] for k in keys]):
+        overrides = {}
+        for k, v in zip(keys, values):
+            set_key(overrides, k, v)
+        variants.append({'name': '-'.join(variant_name(k, v) for k, v in zip(keys, values)), 'config': overrides})
+    return variants
+
+
+def expand_variants(config):
+    """Returns the (name, config) pairs to render every mesh with.
+
+    The variants are given either as a list of named overrides in config['variants'] or as a sweep over config keys
+    in config['sweep']. Each variant renders into its own subdirectory of out_dir. Without variants the config is
+    returned unchanged with None as name.
+    """
+    variants = list(config.get('variants', []))
+    if config.get('sweep'):
+        for key in config['sweep']:
+            try:
+                get_key(config, key)
+            except (KeyError, TypeError):
+                raise ValueError(f'Unknown sweep key {key}')
+        variants += expand_sweep(config['sweep'])
+    base = {k: v for k, v in config.items() if k not in ['variants', 'sweep']}
+    if not variants:
+        return [(None, base)]
+
+    expanded = []
+    for variant in variants:
+        name = variant['name']
+        if name in [n for n, _ in expanded]:
+            raise ValueError(f'Duplicate variant name {name}')
+        merged = merge_config(base, variant.get('config', {}))
+        changed = [k for k in FIXED_KEYS if get_key(merged, k) != get_key(base, k)]
+        if changed:
+            raise ValueError(f'Variant {name} changes {changed}, these settings are shared by all variants')
+        merged['out_dir'] = os.path.join(merged['out_dir'], name)
+        expanded.append((name, merged))
+    return expanded
@@ -0,0 +1,136 @@
+import hashlib
+
+import numpy as np
+
+GOLDEN_ANGLE = np.pi * (3. - np.sqrt(5.))
+
+
+def instance_seed(seed, instance_name):
+    """Derives a reproducible seed per instance, None keeps the sampling random."""
+    if seed is None:
+        return None
+    digest = hashlib.sha1(f'{seed}:{instance_name}'.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+def random_rotation(rng):
+    # QR decomposition of a gaussian matrix gives a uniformly distributed rotation
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] *= -1
+    return q
+
+
+def random_sphere(n, radius, seed=None):
+    rng = np.random.default_rng(seed) if seed is not None else np.random
+    xyz = rng.normal(size=(n, 3))
+    return xyz / np.linalg.norm(xyz, axis=-1, keepdims=True) * radius
+
+
+def fibonacci_sphere(n, radius, seed=None):
+    """Exactly n nearly evenly spaced points, randomly rotated per seed so that instances do not share views."""
+    k = np.arange(n) + 0.5
+    z = 1. - 2. * k / n
+    r = np.sqrt(1. - z ** 2)
+    phi = GOLDEN_ANGLE * k
+    xyz = np.stack([r * np.cos(phi), r * np.sin(phi), z], axis=-1)
+    if seed is not None:
+        xyz = xyz @ random_rotation(np.random.default_rng(seed)).T
+    return xyz * radius
+
+
+def archimedean_spiral(n, radius):
+    """https://en.wikipedia.org/wiki/Spiral, section "Spherical spiral". c = a / pi
+
+    Same spiral as the original loop, from the equator to the pole, but always with exactly n points.
+    """
+    a = 40
+    i = a / 2 + np.arange(n) * a / (2 * n)
+    theta = i / a * np.pi
+    x = radius * np.sin(theta) * np.cos(-i)
+    y = radius * np.sin(-theta + np.pi) * np.sin(-i)
+    z = radius * - np.cos(theta)
+    return np.stack([x, y, z], axis=-1)
+
+
+def sample_positions(mode, n, radius, seed=None):
+    if mode == 'train':
+        return random_sphere(n, radius, seed)
+    elif mode == 'test':
+        return archimedean_spiral(n, radius)
+    elif mode == 'fibonacci':
+        return fibonacci_sphere(n, radius, seed)
+    raise ValueError(f'Unknown mode {mode}, expected "train", "test" or "fibonacci"')
+
+
+def surface_samples(vertices, triangles, n, seed=None):
+    """Area-weighted random points on the triangles together with their face normals."""
+    rng = np.random.default_rng(seed)
+    v0, v1, v2 = [vertices[triangles[:, i]] for i in range(3)]
+    cross = np.cross(v1 - v0, v2 - v0)
+    area = np.linalg.norm(cross, axis=-1)
+    valid = area > 0
+    if not valid.any():
+        return np.zeros((0, 3)), np.zeros((0, 3))
+    idx = rng.choice(np.flatnonzero(valid), size=n, p=area[valid] / area[valid].sum())
+    # uniform barycentric coordinates
+    u, v = rng.random(n), rng.random(n)
+    flip = u + v > 1
+    u[flip], v[flip] = 1 - u[flip], 1 - v[flip]
+    points = v0[idx] + u[:, None] * (v1[idx] - v0[idx]) + v[:, None] * (v2[idx] - v0[idx])
+    return points, cross[idx] / area[idx, None]
+
+
+def visibility(points, normals, camera, fov, resolution=64, target=np.zeros(3)):
+    """Which surface points a camera looking at the target sees, occlusion is tested with a coarse depth buffer."""
+    forward = target - camera
+    forward = forward / np.linalg.norm(forward)
+    right = np.cross(forward, [0., 0., 1.])
+    if np.linalg.norm(right) < 1e-6:
+        right = np.cross(forward, [0., 1., 0.])
+    right = right / np.linalg.norm(right)
+    up = np.cross(right, forward)
+
+    d = points - camera
+    depth = d @ forward
+    tan = np.tan(fov / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (d @ right) / (depth * tan)
+        y = (d @ up) / (depth * tan)
+    # inside the frustum & not seen exactly edge-on, two-sided as ShapeNet meshes are often inconsistently wound
+    candidate = (depth > 0) & (np.abs(x) < 1) & (np.abs(y) < 1) & (np.abs(np.einsum('ij,ij->i', normals, d)) > 0)
+
+    px = ((x[candidate] + 1) / 2 * resolution).astype(np.int64).clip(0, resolution - 1)
+    py = ((y[candidate] + 1) / 2 * resolution).astype(np.int64).clip(0, resolution - 1)
+    pixel = py * resolution + px
+    zbuffer = np.full(resolution * resolution, np.inf)
+    np.minimum.at(zbuffer, pixel, depth[candidate])
+    # a point is visible if it is not much further away than the nearest point in its pixel
+    tolerance = 2 * np.linalg.norm(camera) * tan / resolution
+    visible = np.zeros(len(points), dtype=bool)
+    visible[candidate] = depth[candidate] <= zbuffer[pixel] + tolerance
+    return visible
+
+
+def plan_coverage(points, normals, candidates, fov, target_coverage=0.95, max_views=None, resolution=64):
+    """Greedily picks the fewest candidate cameras that see the target fraction of the surface.
+
+    The fraction is relative to the surface seen by any candidate, so interior faces do not count. Returns the indices
+    of the chosen candidates and the coverage reached.
+    """
+    vis = np.stack([visibility(points, normals, c, fov, resolution) for c in candidates])
+    reachable = vis.any(axis=0).sum()
+    if reachable == 0:
+        return [], 0.0
+    covered = np.zeros(len(points), dtype=bool)
+    chosen = []
+    max_views = len(candidates) if max_views is None else max_views
+    while len(chosen) < max_views and covered.sum() < target_coverage * reachable:
+        gains = vis[:, ~covered].sum(axis=1)
+        best = int(np.argmax(gains))
+        if gains[best] == 0:
+            break
+        chosen.append(best)
+        covered |= vis[best]
+    return chosen, covered.sum() / reachable